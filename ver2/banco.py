@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#--------------------------------------------------------------------------------------------------------------
+# BANCO -- Banco de pruebas de KFRONT v.2. Mide cuanto tarda kfront en orquestar el cluster (no los programas
+# del usuario) y cuantas llamadas remotas hace, para ver como crece con la cantidad de nodos y detectar
+# regresiones entre versiones.
+#
+# Uso: ./banco.py [--nodos 5,50,500] [--latencia S] [--caidos P] [--fallas P] [--resultados ARCHIVO]
+#
+# No hace falta el cluster: rsh, rcp, ping, recon, lamboot, lamnodes, lamgrow, lamshrink, lamhalt, tping,
+# lamclean, wipe, mpicc y mpirun se reemplazan por scripts locales (en un directorio temporal que va primero en
+# el PATH). Cada "nodo" es un shell local al que se llega con el rsh simulado, que demora cada comando
+# --latencia segundos (el tiempo de ida y vuelta de la red). Como en el transporte falso de kfront, cada nodo
+# tiene su propio home (un directorio de falso/, donde el rsh simulado cambia las rutas del home del front por
+# las del nodo), asi que rcp copia de verdad de un nodo a otro. Un --caidos por ciento de los nodos no responde
+# (ni al ping ni al rsh) y un --fallas por ciento de las copias con rcp falla al azar.
+#
+# Para cada cantidad de nodos se corre kfront2 en un proceso aparte, con un HOME temporal y la traza activada
+# (KFRONT_TRAZA), y se mide cada operacion: arranque (carga de nodos), lamboot, cambios de configuracion,
+# compilacion, copia, ejecucion y lamhalt. De cada una se informa el tiempo y las llamadas remotas: comandos
+# por los canales (de la traza), conexiones rsh, pings y copias rcp. Los resultados se agregan (una linea JSON
+# por corrida, con la revision de git) al archivo de resultados y se comparan con la corrida anterior de las
+# mismas caracteristicas.
+#
+# Autor: Constantino A. Palacio.
+#--------------------------------------------------------------------------------------------------------------
+
+import argparse, collections, contextlib, json, os, random, shutil, subprocess, sys, tempfile, time
+
+dir_programa = os.path.dirname(os.path.realpath(__file__))
+
+# Operaciones que se miden, en el orden en que se corren
+
+operaciones = ["arranque", "lamboot", "seleccionar", "intercambiar", "agregar", "quitar", "compilar_todos",
+               "compilar_cache", "compilar_paquete", "compilar_maestro", "copiar", "ejecutar", "lamhalt"]
+
+# Comandos simulados. Todos anotan su nombre en $KFSIM_DIR/llamadas; los nodos caidos estan en $KFSIM_DIR/caidos
+# y el home de cada nodo es $KFRONT_FALSO/<nodo> (el home del front es $KFSIM_HOME).
+
+simulados = {
+  "rsh": r'''
+echo rsh >> "$KFSIM_DIR/llamadas"
+grep -qx "$1" "$KFSIM_DIR/caidos" && { echo "$1: Connection refused" >&2; exit 1; }
+sleep $KFSIM_LATENCIA
+HOME="$KFRONT_FALSO/$1"; export HOME
+mkdir -p "$HOME" && cd "$HOME" || exit 1
+# Un comando suelto (rsh nodo comando, sin sesion) corre con la entrada estandar tal cual
+shift
+[ "$*" = sh ] || exec sh -c "$(printf '%s\n' "$*" | sed "s#$KFSIM_HOME\([^[:alnum:]_.-]\|\$\)#$HOME\1#g")"
+# Cada comando de kfront termina con el printf de su marca: ahi se cobra la latencia
+while IFS= read -r linea; do
+  case "$linea" in "printf '\\n__KFRONT_"*) sleep $KFSIM_LATENCIA;; esac
+  printf '%s\n' "$linea"
+done | sed -u "s#$KFSIM_HOME\([^[:alnum:]_.-]\|\$\)#$HOME\1#g" | sh
+''',
+  "ping": r'''
+echo ping >> "$KFSIM_DIR/llamadas"
+h=$(eval echo \${$#})
+grep -qx "$h" "$KFSIM_DIR/caidos" && { sleep 1; exit 1; }
+sleep $KFSIM_LATENCIA
+''',
+  "rcp": r'''
+echo rcp >> "$KFSIM_DIR/llamadas"
+h=${2%%:*}
+grep -qx "$h" "$KFSIM_DIR/caidos" && { echo "rcp: $h: Connection refused"; exit 1; }
+[ $(( $(od -An -N1 -tu1 /dev/urandom) * 100 / 256 )) -lt $KFSIM_FALLAS ] && { echo "rcp: $h: Connection reset"; exit 1; }
+sleep $KFSIM_LATENCIA
+destino="$KFRONT_FALSO/$h${2#*:$HOME}"
+mkdir -p "${destino%/*}" && cp "$1" "$destino"
+''',
+  "recon": r'''
+echo recon >> "$KFSIM_DIR/llamadas"
+echo "Woo hoo!"
+''',
+  "lamboot": r'''
+echo lamboot >> "$KFSIM_DIR/llamadas"
+f=$(eval echo \${$#})
+sleep $KFSIM_LATENCIA
+i=0; : > "$KFSIM_DIR/lam"
+grep -v '^#' "$f" | while read h resto; do [ -n "$h" ] || continue
+  c=$(echo "$resto" | sed -n 's/.*cpu=\([0-9]*\).*/\1/p')
+  fl=""; [ $i = 0 ] && fl="origin,this_node"
+  echo "$i $h ${c:-1} $fl" >> "$KFSIM_DIR/lam"; i=$((i+1)); done
+echo "LAM 7.1.4 booted"
+''',
+  "lamnodes": r'''
+echo lamnodes >> "$KFSIM_DIR/llamadas"
+[ -s "$KFSIM_DIR/lam" ] || { echo "-----------------------------------------------------------------------------"
+  echo "It seems that there is no lamd running on the host"; exit 1; }
+sort -n "$KFSIM_DIR/lam" | while read i h c fl; do printf 'n%s\t%s:%s:%s\n' $i $h $c "$fl"; done
+''',
+  "lamgrow": r'''
+echo lamgrow >> "$KFSIM_DIR/llamadas"
+c=1
+while [ $# -gt 1 ]; do case $1 in -n) id=$2; shift 2;; -cpu) c=$2; shift 2;; *) shift;; esac; done
+grep -q "^$id " "$KFSIM_DIR/lam" && { echo "lamgrow: node id in use"; exit 1; }
+sleep $KFSIM_LATENCIA
+echo "$id $1 $c " >> "$KFSIM_DIR/lam"
+''',
+  "lamshrink": r'''
+echo lamshrink >> "$KFSIM_DIR/llamadas"
+grep -v "^${1#n} " "$KFSIM_DIR/lam" > "$KFSIM_DIR/lam.t"; mv "$KFSIM_DIR/lam.t" "$KFSIM_DIR/lam"
+''',
+  "lamhalt": r'''
+echo lamhalt >> "$KFSIM_DIR/llamadas"
+rm -f "$KFSIM_DIR/lam"; echo "LAM halted"
+''',
+  "tping": r'''
+echo tping >> "$KFSIM_DIR/llamadas"
+echo "1 byte from each node"
+''',
+  "lamclean": r'''
+echo lamclean >> "$KFSIM_DIR/llamadas"
+''',
+  "wipe": r'''
+echo wipe >> "$KFSIM_DIR/llamadas"
+rm -f "$KFSIM_DIR/lam"
+''',
+  "mpicc": r'''
+echo mpicc >> "$KFSIM_DIR/llamadas"
+sleep $KFSIM_LATENCIA
+cp "$3" "$2"
+''',
+  "mpirun": r'''
+echo mpirun >> "$KFSIM_DIR/llamadas"
+sleep $KFSIM_LATENCIA
+echo "mpirun $*"
+''',
+}
+
+# Fuentes de prueba: uno para compilar en todos, otro con un encabezado (va en un paquete) y otro para compilar
+# en el maestro y copiar, distinto del primero para que la copia no se saltee por tener la misma suma md5
+
+fuentes_prueba = {
+  "prueba.c": "int main() { return 0; }\n",
+  "paquete.c": "#include \"paquete.h\"\nint main() { return CODIGO; }\n",
+  "paquete.h": "#define CODIGO 0\n",
+  "maestro.c": "int main() { return 1 - 1; }\n",
+}
+#
+#--------------------------------------------------------------------------------------------------------------
+# armar_simulacion: crea el directorio de la simulacion con los comandos simulados (en bin), el archivo de
+# nodos, la lista de nodos caidos y los fuentes de prueba. Devuelve el entorno para correr kfront2.
+#--------------------------------------------------------------------------------------------------------------
+def armar_simulacion(directorio, cantidad, latencia, caidos, fallas):
+  os.makedirs(os.path.join(directorio, "bin"))
+  os.makedirs(os.path.join(directorio, "home"))
+  os.makedirs(os.path.join(directorio, "falso"))
+
+  for nombre, script in simulados.items():
+    ruta = os.path.join(directorio, "bin", nombre)
+    with open(ruta, "w") as f:
+      f.write("#!/bin/sh" + script)
+    os.chmod(ruta, 0o755)
+
+  # El primer nodo nunca se cae (es el maestro), tampoco el que se agrega durante la prueba; los caidos se
+  # eligen siempre igual para cada cantidad
+  nombres = [f"sim{i:03d}" for i in range(cantidad + 1)]
+  azar = random.Random(cantidad)
+  abajo = [n for n in nombres[1:cantidad] if azar.random() * 100 < caidos]
+
+  with open(os.path.join(directorio, "nodos"), "w") as f:
+    f.write("\n".join(nombres[:cantidad]) + "\n")
+  with open(os.path.join(directorio, "caidos"), "w") as f:
+    f.write("".join(f"{n}\n" for n in abajo))
+  for nombre, texto in fuentes_prueba.items():
+    with open(os.path.join(directorio, nombre), "w") as f:
+      f.write(texto)
+  open(os.path.join(directorio, "llamadas"), "w").close()
+
+  entorno = dict(os.environ)
+  entorno.update(PATH=os.path.join(directorio, "bin") + os.pathsep + os.environ["PATH"],
+                 HOME=os.path.join(directorio, "home"), KFSIM_DIR=directorio, KFSIM_LATENCIA=str(latencia),
+                 KFSIM_HOME=os.path.join(directorio, "home"), KFRONT_FALSO=os.path.join(directorio, "falso"),
+                 KFSIM_FALLAS=str(fallas), KFRONT_TRANSPORTE="rsh", KFRONT_PUERTOS="", KFRONT_BENCHMARK="0",
+                 KFRONT_TRAZA=os.path.join(directorio, "traza.jsonl"), KFRONT_LOGS="")
+  return entorno
+#
+#--------------------------------------------------------------------------------------------------------------
+# escenario: lo que corre el proceso hijo. Importa kfront2 (con el entorno de la simulacion ya armado) y mide
+# cada operacion, sin mostrar la salida de kfront. Deja {operacion: {"segundos", "comandos", "rsh", "ping",
+# "rcp"}} en resultados.json del directorio de la simulacion.
+#--------------------------------------------------------------------------------------------------------------
+def escenario(directorio, cantidad):
+  sys.path.insert(0, dir_programa)
+  import kfront2
+
+  traza = os.environ["KFRONT_TRAZA"]
+  resultados = {}
+
+  def contar():
+    cuenta = collections.Counter()
+    if os.path.exists(traza):
+      with open(traza) as f:
+        cuenta["comandos"] = sum(1 for linea in f if '"tipo": "remoto"' in linea)
+    with open(os.path.join(directorio, "llamadas")) as f:
+      cuenta.update(linea.strip() for linea in f)
+    return cuenta
+
+  def medir(nombre, funcion, *args):
+    antes = contar()
+    inicio = time.perf_counter()
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+      funcion(*args)
+    segundos = time.perf_counter() - inicio
+    llamadas = contar() - antes
+    resultados[nombre] = {"segundos": round(segundos, 4), "comandos": llamadas["comandos"], "rsh": llamadas["rsh"],
+                          "ping": llamadas["ping"], "rcp": llamadas["rcp"]}
+
+  fuente = os.path.join(directorio, "prueba")
+  encabezado = os.path.join(directorio, "paquete.h")
+  ultimo = f"n{cantidad-1}"
+
+  def reconfigurar_seleccion():
+    kfront2.seleccionar(ultimo)
+    kfront2.seleccionar(ultimo)
+
+  def ejecutar():
+    kfront2.correr_mpirun(kfront2.nombre_binario, "", None, None, False)
+    kfront2.limpiar_binario(kfront2.nombre_binario)
+
+  medir("arranque", kfront2.cargar_nodos, os.path.join(directorio, "nodos"))
+  medir("lamboot", kfront2.iniciar_lamboot)
+  medir("seleccionar", reconfigurar_seleccion)
+  medir("intercambiar", kfront2.swap_nodos, "n1", ultimo)
+  medir("agregar", kfront2.agregar_nodo, f"sim{cantidad:03d}")
+  medir("quitar", kfront2.quitar_nodo, f"n{cantidad}")
+  medir("compilar_todos", kfront2.compilar_en_todos, fuente, False)
+  medir("compilar_cache", kfront2.compilar_en_todos, fuente, False)
+  medir("compilar_paquete", kfront2.compilar_en_todos, os.path.join(directorio, "paquete"), False, [encabezado])
+  medir("compilar_maestro", kfront2.compilar_job, os.path.join(directorio, "maestro"), False)
+  medir("copiar", kfront2.copiar_binario)
+  medir("ejecutar", ejecutar)
+  medir("lamhalt", kfront2.chau_lam)
+
+  with open(os.path.join(directorio, "resultados.json"), "w") as f:
+    json.dump(resultados, f)
+#
+#--------------------------------------------------------------------------------------------------------------
+# revision: devuelve la revision de git del arbol de kfront (con "+" si tiene cambios sin confirmar), o "-".
+#--------------------------------------------------------------------------------------------------------------
+def revision():
+  try:
+    rev = subprocess.run(["git", "-C", dir_programa, "rev-parse", "--short", "HEAD"], capture_output=True,
+                         text=True, check=True).stdout.strip()
+    cambios = subprocess.run(["git", "-C", dir_programa, "status", "--porcelain", "--untracked-files=no"],
+                             capture_output=True, text=True).stdout.strip()
+    return rev + ("+" if cambios else "")
+  except (OSError, subprocess.CalledProcessError):
+    return "-"
+#
+#--------------------------------------------------------------------------------------------------------------
+# anterior: busca en el archivo de resultados la ultima corrida con las mismas caracteristicas.
+#--------------------------------------------------------------------------------------------------------------
+def anterior(archivo, corrida):
+  previa = None
+  claves = ("nodos", "latencia", "caidos", "fallas")
+  if os.path.exists(archivo):
+    with open(archivo) as f:
+      for linea in f:
+        try:
+          r = json.loads(linea)
+        except ValueError:
+          continue
+        if all(r.get(c) == corrida[c] for c in claves):
+          previa = r
+  return previa
+#
+#--------------------------------------------------------------------------------------------------------------
+# informar: muestra los resultados de una corrida y, si hay una anterior, la diferencia de tiempo con ella.
+#--------------------------------------------------------------------------------------------------------------
+def informar(corrida, previa):
+  print(f"\n\033[0m{corrida['nodos']} nodos (revision {corrida['revision']}, latencia {corrida['latencia']} s, "
+        f"{corrida['caidos']}% caidos, {corrida['fallas']}% de copias fallidas)")
+  if previa:
+    print(f"Comparado con la revision {previa['revision']} del {previa['fecha']}")
+  print("-"*78)
+  print(f"\t{'operacion':<18} {'segundos':>9} {'comandos':>9} {'rsh':>6} {'ping':>6} {'rcp':>6}  {'anterior':>9}")
+  for nombre in operaciones:
+    o = corrida["operaciones"].get(nombre)
+    if o is None:
+      continue
+    antes = previa["operaciones"].get(nombre) if previa else None
+    delta = ""
+    if antes and antes["segundos"] > 0:
+      cambio = (o["segundos"] - antes["segundos"]) / antes["segundos"] * 100
+      color = 31 if cambio > 10 else 32 if cambio < -10 else 0
+      delta = f"\033[{color}m{cambio:>+8.0f}%\033[0m"
+    print(f"\t{nombre:<18} {o['segundos']:>9.3f} {o['comandos']:>9} {o['rsh']:>6} {o['ping']:>6} {o['rcp']:>6}  {delta}")
+  print("-"*78+f"\nTotal: {sum(o['segundos'] for o in corrida['operaciones'].values()):.3f} s")
+#
+#--------------------------------------------------------------------------------------------------------------
+# Programa principal
+#--------------------------------------------------------------------------------------------------------------
+def main():
+  parser = argparse.ArgumentParser(description="Banco de pruebas de KFRONT v.2 con un cluster simulado")
+  parser.add_argument("--nodos", default="5,50,500", help="cantidades de nodos, separadas por comas")
+  parser.add_argument("--latencia", type=float, default=0.005, help="segundos de ida y vuelta de cada comando")
+  parser.add_argument("--caidos", type=float, default=0, help="por ciento de nodos que no responden")
+  parser.add_argument("--fallas", type=int, default=0, help="por ciento de copias rcp que fallan")
+  parser.add_argument("--resultados", default=os.path.join(os.path.expanduser("~"), ".kfront", "banco.jsonl"),
+                      help="archivo donde se acumulan los resultados")
+  parser.add_argument("--escenario", nargs=2, metavar=("DIRECTORIO", "NODOS"), help=argparse.SUPPRESS)
+  opciones = parser.parse_args()
+
+  # Proceso hijo: corre las operaciones y deja las mediciones en el directorio de la simulacion
+
+  if opciones.escenario:
+    escenario(opciones.escenario[0], int(opciones.escenario[1]))
+    return
+
+  for cantidad in [int(n) for n in opciones.nodos.split(",") if n]:
+    directorio = tempfile.mkdtemp(prefix="kfront_banco_")
+    try:
+      entorno = armar_simulacion(directorio, cantidad, opciones.latencia, opciones.caidos, opciones.fallas)
+      print(f"\033[32mSimulando {cantidad} nodos..\033[0m")
+      hijo = subprocess.run([sys.executable, os.path.realpath(__file__), "--escenario", directorio, str(cantidad)],
+                            env=entorno, cwd=entorno["HOME"], capture_output=True, text=True)
+      if hijo.returncode != 0:
+        print(f"\033[31mError: fallo la simulacion de {cantidad} nodos.\033[0m\n{hijo.stderr}")
+        continue
+      with open(os.path.join(directorio, "resultados.json")) as f:
+        mediciones = json.load(f)
+    finally:
+      shutil.rmtree(directorio, ignore_errors=True)
+
+    corrida = {"fecha": time.strftime("%Y-%m-%d %H:%M:%S"), "revision": revision(), "nodos": cantidad,
+               "latencia": opciones.latencia, "caidos": opciones.caidos, "fallas": opciones.fallas,
+               "operaciones": mediciones}
+
+    informar(corrida, anterior(opciones.resultados, corrida))
+
+    os.makedirs(os.path.dirname(os.path.abspath(opciones.resultados)), exist_ok=True)
+    with open(opciones.resultados, "a") as f:
+      f.write(json.dumps(corrida) + "\n")
+
+if __name__ == "__main__":
+  main()
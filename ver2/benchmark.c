@@ -0,0 +1,89 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/time.h>
+
+// Benchmark de kfront: mide la velocidad de un nodo con una multiplicacion de matrices por bloques (como la de
+// ej2_mpi4.c) y un recorrido "triad" de la memoria. Imprime una linea "MFLOPS MB/s". No usa MPI: kfront lo
+// compila y lo corre en cada nodo por separado, todos a la vez.
+
+#define N 256
+#define BS 32
+#define M (2*1024*1024)
+
+// para mediciones de tiempo
+double dwalltime(){
+	double sec;
+	struct timeval tv;
+
+	gettimeofday(&tv,NULL);
+	sec = tv.tv_sec + tv.tv_usec/1000000.0;
+	return sec;
+}
+
+// interna blkmul: realiza la multiplicación de dos bloques bs x bs
+void blkmul(double *ablk, double *bblk, double *cblk, int n, int bs){
+    int i,j,k;
+    for (i=0;i<bs;i++)
+        for (j=0;j<bs;j++)
+            for (k=0;k<bs;k++)
+                cblk[i*n+j] += ablk[i*n+k] * bblk[j*n+k];
+}
+
+// externa matmulblks: multiplica invocando a blkmul de a bloques de tamaño bs.
+void matmulblks(double *a, double *b, double *c, int n, int bs){
+    int i,j,k;
+    for (i=0;i<n;i+=bs)
+        for (j=0;j<n;j+=bs)
+            for (k=0;k<n;k+=bs)
+                blkmul(&a[i*n+k], &b[k+n*j], &c[i*n+j], n, bs);
+}
+
+int main(){
+    double *a, *b, *c, t, mflops, mbs, control;
+    int i, r, reps;
+
+    // Computo: se repite la multiplicacion hasta juntar al menos medio segundo
+
+    a = (double*)malloc(sizeof(double)*N*N);
+    b = (double*)malloc(sizeof(double)*N*N);
+    c = (double*)malloc(sizeof(double)*N*N);
+    if (!a || !b || !c) return 1;
+
+    for (i=0;i<N*N;i++) { a[i] = 1.0; b[i] = 1.0; c[i] = 0.0; }
+
+    reps = 0;
+    t = dwalltime();
+    do {
+        matmulblks(a, b, c, N, BS);
+        reps++;
+    } while (dwalltime() - t < 0.5);
+    t = dwalltime() - t;
+    mflops = 2.0*N*N*N*reps / t / 1e6;
+    control = c[0];
+
+    free(a); free(b); free(c);
+
+    // Memoria: a = b + 3c sobre vectores mucho mas grandes que el cache, tambien durante medio segundo
+
+    a = (double*)malloc(sizeof(double)*M);
+    b = (double*)malloc(sizeof(double)*M);
+    c = (double*)malloc(sizeof(double)*M);
+    if (!a || !b || !c) return 1;
+
+    for (i=0;i<M;i++) { a[i] = 0.0; b[i] = 1.0; c[i] = 2.0; }
+
+    reps = 0;
+    t = dwalltime();
+    do {
+        for (r=0;r<M;r++) a[r] = b[r] + 3.0*c[r];
+        reps++;
+    } while (dwalltime() - t < 0.5);
+    t = dwalltime() - t;
+    mbs = 3.0*sizeof(double)*M*reps / t / 1e6;
+    control += a[M-1];
+
+    free(a); free(b); free(c);
+
+    printf("%.1f %.1f\n", mflops, mbs);
+    return control < 0;
+}
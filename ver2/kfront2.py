@@ -6,30 +6,187 @@
 # carga y ejecucion de programas escritos en lenguaje C y automatiza la administracion y configuracion de los
 # parametros de un cluster de monoprocesadores.
 #
-# Uso: se invoca con o sin argumentos. El unico argumento que se procesa es una ruta de acceso a un archivo de
+# Uso: se invoca con o sin argumentos. El unico argumento posicional es una ruta de acceso a un archivo de
 # texto plano que contiene una lista de nombres/direcciones IP de los distintos nodos del clustes. De no
 # recibirse ningun argumento, se arma una lista por defecto con los nodos "alfa00" a "alfa04" (direcciones IP
-# en rango 192.168.1.200 a 192.168.1.204).
+# en rango 192.168.1.200 a 192.168.1.204). Con --batch trabajos.toml se corren los trabajos del manifiesto sin
+# pasar por el menu (ver leer_manifiesto); --resumen indica donde dejar los resultados.
 #
 # Esta es la segunda version del programa. Soporta varios procesos de MPI en los nodos, sean de 1 o mas cores.
 # El archivo de hosts es igual, pero el programa va a contar las ocurrencias de cada IP/nombre que lea y las va
 # a guardar una unica vez, contando las ocurrencias en un nuevo parametro TIMES, que luego le va a indicar al
 # lamboot cuantos procesos crear en ese nodo. Esto ya andaba en la version anterior, pero era un poco dificil
-# de manejar.
+# de manejar. Si un nodo aparece una sola vez, TIMES es la cantidad de cores que informa el propio nodo. Si
+# hay puntajes del benchmark (ver ordenar_por_velocidad), los nodos mas rapidos van primero y reciben mas procesos.
 #
 # Version: XXX/YY
 #
 # Autor: Constantino A. Palacio.
 #--------------------------------------------------------------------------------------------------------------
 
-import os, subprocess, sys, tempfile, time
+import argparse, asyncio, atexit, base64, collections, functools, hashlib, itertools, json, os, random, re, socket, subprocess, sys, tarfile, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
 
 # Obtener el directorio home del usuario
 home_dir = os.environ['HOME']
 
-maestro = "-"
+# Parametros de la prueba de conexion: tiempo maximo de espera de cada ping (en segundos) y cantidad maxima de
+# pruebas simultaneas al descubrir los nodos. Se pueden cambiar desde el entorno sin tocar el programa.
+timeout_ping = int(os.environ.get("KFRONT_TIMEOUT_PING", "1"))
+max_sondeos = int(os.environ.get("KFRONT_MAX_SONDEOS", "16"))
+
+# Puertos TCP que se prueban para saber si un nodo esta vivo, en ese orden; si no se indican, los del transporte
+# (rsh y ssh, o solo ssh). El ping queda como ultimo recurso. El resultado de cada prueba se guarda en el cache
+# de salud durante ttl_salud segundos.
+puertos_sondeo = [int(p) for p in os.environ["KFRONT_PUERTOS"].split(",") if p] if "KFRONT_PUERTOS" in os.environ else None
+ttl_salud = float(os.environ.get("KFRONT_TTL_SALUD", "30"))
+
+salud = {}                      # nombre/IP -> (online, instante de la prueba)
+salud_lock = threading.Lock()
+
+# Estado de la sesion LAM tal como lo conoce kfront. Se actualiza solo cuando kfront ejecuta lamboot, lamhalt,
+# lamgrow o lamshrink, y se vuelve a preguntar al maestro (lamnodes) recien cuando el dato tiene mas de ttl_lam
+# segundos o cuando se pide explicitamente. activo=None significa que todavia no se sabe; universo es la ultima
+# salida de lamnodes ya interpretada (lista de NodoLam), o None si cambio desde entonces. Todo lo que lee o
+# cambia la sesion (lamnodes, lamboot, lamhalt, lamgrow, lamshrink) se hace con lam_lock tomado, ya sea desde el
+# menu, el planificador o el monitor (ver exclusivo_lam).
+ttl_lam = float(os.environ.get("KFRONT_TTL_LAM", "60"))
+
+estado_lam = {"activo": None, "universo": None, "instante": 0.0}
+lam_lock = threading.RLock()
+
+# Arranque de LAM: despues de lanzar lamboot se consulta lamnodes hasta que esten todos los nodos, empezando
+# cada espera_lam segundos y duplicando la espera en cada intento (hasta espera_lam_max), con un plazo total
+# de plazo_lam segundos. El tiempo que tardo queda en metricas["lamboot"], que va al resumen del modo batch y,
+# si hay traza, como evento "lamboot".
+espera_lam = 0.2
+espera_lam_max = 2.0
+plazo_lam = float(os.environ.get("KFRONT_PLAZO_LAM", "60"))
+
+metricas = {}                   # nombre -> ultimo valor medido (segundos)
+
+# Canales remotos: kfront mantiene abierta una sesion de shell por nodo ("rsh nodo sh") y la reutiliza para
+# todos los comandos que manda a ese nodo; si hace falta correr dos comandos a la vez en el mismo nodo (por
+# ejemplo, dos mpirun en el maestro) se abre otra. Un canal que no se usa durante inactividad_canal segundos se
+# cierra. Como se abre la sesion, como se copia un archivo de un nodo a otro y como se prueba si un nodo esta
+# vivo depende del transporte elegido con KFRONT_TRANSPORTE (ver Transporte): rsh (rsh/rcp), ssh (ssh/scp),
+# local (todos los nodos son la maquina local) o falso (un cluster falso de directorios en dir_falso).
+nombre_transporte = os.environ.get("KFRONT_TRANSPORTE", "rsh")
+dir_falso = os.environ.get("KFRONT_FALSO", os.path.join(home_dir, ".kfront", "falso"))
+inactividad_canal = float(os.environ.get("KFRONT_INACTIVIDAD", "300"))
+
+canales = {}                    # nombre/IP -> lista de Canal abiertos
+canales_lock = threading.Lock()
+
+# Comandos en varios nodos (ejecutar_en_nodos): se mandan todos a la vez, con a lo sumo max_remotos en curso en
+# total y max_por_nodo en un mismo nodo (cada uno en su propio canal).
+max_remotos = int(os.environ.get("KFRONT_MAX_REMOTOS", "32"))
+max_por_nodo = int(os.environ.get("KFRONT_MAX_POR_NODO", "2"))
+
+# Distribucion del binario: "arbol" reparte la copia en un arbol binomial (cada nodo que ya tiene el archivo se
+# lo pasa a otro en cada ronda); "secuencial" es la forma original, el maestro copia a cada nodo de a uno.
+modo_copia = os.environ.get("KFRONT_COPIA", "arbol")
+
+# Firma de arquitectura de cada nodo (maquina + modelo de CPU), para compilar una sola vez por tipo de nodo en
+# un cluster heterogeneo. Se consulta una vez por nodo y queda guardada mientras corre kfront.
+firmas = {}                     # nombre/IP -> firma
+firma_desconocida = "?"         # prefijo de la firma de un nodo que no se pudo consultar
+
+# Cache de compilacion: cada binario compilado se guarda en los nodos (en ~/.kfront_cache) con una clave que sale
+# del contenido del fuente, las opciones de mpicc y la firma de arquitectura. El indice de que clave esta en que
+# nodo vive en el front (~/.kfront/cache.json). Si el fuente no cambio, no se copia ni se compila: se restaura el
+# binario del cache. Cuando el cache ocupa mas de KFRONT_CACHE_MB en un nodo se borran de ese nodo las entradas
+# usadas hace mas tiempo.
+dir_kfront = os.path.join(home_dir, ".kfront")
+dir_cache = ".kfront_cache"
+limite_cache = int(os.environ.get("KFRONT_CACHE_MB", "256")) * 1024 * 1024
+opciones_mpicc = "-lm"
+
+cache_lock = threading.Lock()
+clave_binario = None            # clave de cache del binario actual (None si no se conoce)
+
+# Cola de trabajos del planificador: un archivo JSON por trabajo en ~/.kfront/cola, asi la cola sobrevive a un
+# reinicio. El planificador la revisa cada intervalo_cola segundos. Un trabajo chico puede adelantarse a uno
+# grande que espera procesadores libres (backfill), salvo que el grande lleve esperando mas de
+# KFRONT_ESPERA_MAX segundos: desde ahi no se adelanta nadie hasta que arranque. Los trabajos terminados o
+# fallidos pasan a cola/hecho, donde solo se conservan los ultimos KFRONT_HISTORIAL (con sus logs), asi leer la
+# cola no crece con la historia.
+dir_cola = os.path.join(dir_kfront, "cola")
+dir_hecho = os.path.join(dir_cola, "hecho")
+historial_cola = int(os.environ.get("KFRONT_HISTORIAL", "100"))
+intervalo_cola = 2.0
+espera_max_backfill = float(os.environ.get("KFRONT_ESPERA_MAX", "600"))
+
+# Limpieza diferida: despues de cada ejecucion, el binario se borra de los nodos en segundo plano (ver
+# recolector) y el menu vuelve apenas termina mpirun. Las tareas pendientes (un binario en un nodo) se guardan
+# en ~/.kfront/limpieza.json, asi sobreviven a un reinicio. Un nodo que no responde se reintenta mas tarde, con
+# una espera que arranca en espera_limpieza segundos y se duplica en cada intento (hasta espera_limpieza_max).
+archivo_limpieza = os.path.join(dir_kfront, "limpieza.json")
+espera_limpieza = 5.0
+espera_limpieza_max = 600.0
+
+limpiezas = []                  # tareas pendientes: {"nodo", "binario", "intentos", "proximo"}
+limpieza_lock = threading.Lock()        # protege limpiezas, borrando y el archivo
+borrado_lock = threading.Lock()         # tomado solo mientras el recolector manda el rm
+borrando = set()                # binarios que el recolector esta borrando en este momento
+limpieza_aviso = threading.Event()      # despierta al recolector cuando hay tareas nuevas
+hilo_recolector = None
+
+# Paquetes de trabajo: un trabajo puede llevar, ademas del fuente, otros archivos o directorios (encabezados,
+# otros fuentes, datos de entrada, un Makefile). Se arma un unico tar.gz con todos, que se manda a cada nodo
+# seleccionado por su canal (un solo comando por nodo, todos los nodos a la vez) y se desarma en el directorio de
+# trabajo del binario, ~/<binario>.trabajo. Ahi se compila (con make si hay un Makefile) y ahi corre mpirun.
+dir_trabajo = None              # directorio de trabajo del binario actual (None si no tiene paquete)
+
+# Monitor del cluster: un hilo de fondo que cada intervalo_monitor segundos (con una variacion al azar de
+# +-fluctuacion_monitor, para que las pruebas no caigan siempre juntas) prueba todos los nodos a la vez y
+# consulta el universo LAM en el maestro. Mantiene al dia la columna ONLINE y, si un nodo de LAM deja de
+# responder, lo saca de LAM con lamshrink (y lo deselecciona) para que el proximo mpirun no se cuelgue
+# esperandolo. Con KFRONT_MONITOR=0 no se monitorea.
+intervalo_monitor = float(os.environ.get("KFRONT_MONITOR", "30"))
+fluctuacion_monitor = 0.2
+
+# Benchmark de los nodos: benchmark.c (que esta junto a este programa) se compila y se corre en cada nodo para
+# medir computo (MFLOPS) y ancho de banda de memoria (MB/s). Los puntajes se guardan en ~/.kfront/benchmark.json
+# con el instante de la medicion y no se vuelven a medir hasta que tengan mas de KFRONT_TTL_BENCH horas. Al
+# arrancar, los nodos se ordenan del mas rapido al mas lento (salvo con KFRONT_BENCHMARK=0).
+fuente_benchmark = os.path.join(os.path.dirname(os.path.realpath(__file__)), "benchmark.c")
+ttl_benchmark = float(os.environ.get("KFRONT_TTL_BENCH", "168")) * 3600
+ordenar_al_inicio = os.environ.get("KFRONT_BENCHMARK", "1") != "0"
+
+# Arranque en caliente: kfront guarda el estado del cluster (los nodos con SEL, online y TIMES, el maestro y si
+# LAM esta activo) en ~/.kfront/estado.json despues de cada cambio y al salir. Si se arranca con la misma lista
+# de nodos (el mismo archivo sin cambios, o la lista por defecto) y el mismo transporte, y el estado tiene menos
+# de KFRONT_TTL_ESTADO horas, se carga de ahi sin volver a probar ni consultar cada nodo: la verificacion se hace
+# en segundo plano y una sesion de LAM que siga abierta se reutiliza en vez de apagarla. Con KFRONT_ESTADO=0 se
+# arranca siempre de cero.
+archivo_estado = os.path.join(dir_kfront, "estado.json")
+ttl_estado = float(os.environ.get("KFRONT_TTL_ESTADO", "24")) * 3600
+arranque_en_caliente = os.environ.get("KFRONT_ESTADO", "1") != "0"
+
+origen_estado = None            # de donde salio la lista de nodos (ver origen_de_nodos); None = no se guarda
+ultimo_estado = None            # ultimo estado guardado, para no reescribirlo si no cambio
+
+# Salida de mpirun: se muestra linea a linea a medida que llega, con el tiempo transcurrido, y en memoria se
+# guardan solo las ultimas lineas_salida lineas (para el resumen del modo batch y la cola). Si se define
+# KFRONT_LOGS, la salida completa de cada ejecucion queda ademas en un archivo de ese directorio. Cuando la
+# salida no es una terminal, el tiempo transcurrido se informa cada intervalo_vivo segundos.
+lineas_salida = 100
+dir_logs = os.environ.get("KFRONT_LOGS")
+intervalo_vivo = 30.0
+
+# Traza: con KFRONT_TRAZA=archivo se registra cada comando (nodo, comando, codigo de salida) y cada fase
+# (iniciar_lamboot, compilar_job, copiar_binario, ejecutar_job...) con su inicio y su duracion. Si el archivo
+# termina en .json, al salir se escribe en el formato de eventos de Chrome (se abre con chrome://tracing o con
+# Perfetto para ver la sesion como una linea de tiempo); si no, se agrega una linea JSON por evento a medida que
+# ocurren. Sin KFRONT_TRAZA no se registra nada y las fases ni siquiera se envuelven.
+archivo_traza = os.environ.get("KFRONT_TRAZA")
+
+eventos = []                    # eventos pendientes de escribir (solo para el formato de Chrome)
+tiempo_fases = {}               # nombre de la fase -> segundos acumulados
+traza_lock = threading.Lock()
 
-nodos = []
+maestro = "-"
 
 #
 # variables para almacenar los directorios de los archivos fuente y binario
@@ -60,10 +217,135 @@ def msg_note(texto):
   print(f"\033[32m{texto}.\033[0m")
 #
 #--------------------------------------------------------------------------------------------------------------
-# ping: realiza la prueba de conexion a la IP recibida como argumento.
+# registrar: agrega un evento a la traza. tipo es "fase", "remoto" (comando en un nodo) o "local"; inicio es el
+# instante en que empezo (time.time()) y la duracion se toma hasta ahora.
+#--------------------------------------------------------------------------------------------------------------
+def registrar(tipo, nombre, inicio, nodo=None, comando=None, rc=None):
+  evento = {"tipo": tipo, "nombre": nombre, "inicio": inicio, "duracion": time.time() - inicio,
+            "hilo": threading.current_thread().name, "nodo": nodo, "comando": comando, "rc": rc}
+  with traza_lock:
+    if tipo == "fase":
+      tiempo_fases[nombre] = tiempo_fases.get(nombre, 0.0) + evento["duracion"]
+    if archivo_traza.endswith(".json"):
+      eventos.append(evento)
+    else:
+      with open(archivo_traza, "a") as f:
+        f.write(json.dumps(evento) + "\n")
+#
+#--------------------------------------------------------------------------------------------------------------
+# fase: decorador para las funciones que son una etapa del ciclo compilar-copiar-ejecutar. Si hay traza,
+# registra cada llamada como un evento "fase" con su resultado (si es un booleano o un codigo de salida); si no,
+# devuelve la funcion tal cual.
 #--------------------------------------------------------------------------------------------------------------
-def ping(nodo):
-    return os.system(f"ping -c 1 {nodo} > /dev/null 2>&1")
+def fase(funcion):
+  if not archivo_traza:
+    return funcion
+
+  @functools.wraps(funcion)
+  def medida(*args, **kwargs):
+    inicio = time.time()
+    resultado = None
+    try:
+      resultado = funcion(*args, **kwargs)
+      return resultado
+    finally:
+      rc = resultado[0] if isinstance(resultado, tuple) else resultado
+      registrar("fase", funcion.__name__, inicio, rc=rc if isinstance(rc, (bool, int)) else None)
+
+  return medida
+#
+#--------------------------------------------------------------------------------------------------------------
+# escribir_traza: al salir, si la traza es en formato de Chrome, la escribe: las fases en el proceso "kfront"
+# (una fila por hilo) y los comandos en el proceso "nodos" (una fila por nodo). En los dos formatos muestra
+# cuanto tiempo se fue en cada fase.
+#--------------------------------------------------------------------------------------------------------------
+def escribir_traza():
+  if not archivo_traza:
+    return
+
+  if archivo_traza.endswith(".json"):
+    with traza_lock:
+      lista = list(eventos)
+    filas = {}
+    traza = [{"ph": "M", "name": "process_name", "pid": 0, "args": {"name": "kfront"}},
+             {"ph": "M", "name": "process_name", "pid": 1, "args": {"name": "nodos"}}]
+    cero = min((e["inicio"] for e in lista), default=0)
+    for e in lista:
+      pid = 0 if e["tipo"] == "fase" else 1
+      fila = (pid, e["hilo"] if pid == 0 else e["nodo"] or "front")
+      if fila not in filas:
+        filas[fila] = len(filas)
+        traza.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": filas[fila], "args": {"name": fila[1]}})
+      traza.append({"ph": "X", "name": e["nombre"], "cat": e["tipo"], "pid": pid, "tid": filas[fila],
+                    "ts": round((e["inicio"] - cero) * 1e6), "dur": round(e["duracion"] * 1e6),
+                    "args": {"comando": e["comando"], "rc": e["rc"]}})
+    with open(archivo_traza, "w") as f:
+      json.dump({"traceEvents": traza, "displayTimeUnit": "ms"}, f)
+
+  if tiempo_fases:
+    print("\n\033[0mTiempo por fase:\n"+"-"*40)
+    for nombre, segundos in sorted(tiempo_fases.items(), key=lambda f: -f[1]):
+      print(f"\t{nombre:<24} {segundos:>9.3f} s")
+    print("-"*40)
+
+  msg_note(f"Traza en {archivo_traza}")
+
+atexit.register(escribir_traza)
+#
+#--------------------------------------------------------------------------------------------------------------
+# ping: realiza la prueba de conexion a la IP recibida como argumento. Devuelve 0 si el nodo respondio.
+#--------------------------------------------------------------------------------------------------------------
+def ping(nodo, timeout=None):
+    timeout = timeout_ping if timeout is None else timeout
+    return os.system(f"ping -c 1 -W {timeout} {nodo} > /dev/null 2>&1")
+#
+#--------------------------------------------------------------------------------------------------------------
+# sondear: prueba si un nodo esta vivo sin lanzar procesos, con la prueba del transporte (Transporte.sondear).
+#--------------------------------------------------------------------------------------------------------------
+def sondear(nodo, timeout=None):
+  return transporte.sondear(nodo, timeout_ping if timeout is None else timeout)
+#
+#--------------------------------------------------------------------------------------------------------------
+# en_linea: devuelve True si el nodo esta online. Usa el cache de salud mientras el dato tenga menos de
+# ttl_salud segundos; con forzar=True (o si el dato vencio) vuelve a probar y actualiza el cache.
+#--------------------------------------------------------------------------------------------------------------
+def en_linea(nodo, forzar=False, timeout=None):
+  ahora = time.monotonic()
+
+  with salud_lock:
+    dato = salud.get(nodo)
+  if dato and not forzar and ahora - dato[1] < ttl_salud:
+    return dato[0]
+
+  online = sondear(nodo, timeout)
+
+  with salud_lock:
+    salud[nodo] = (online, time.monotonic())
+
+  return online
+#
+#--------------------------------------------------------------------------------------------------------------
+# invalidar_salud: descarta el dato del cache de salud de un nodo (o de todos si no se indica ninguno), para
+# que la proxima consulta vuelva a probar la conexion.
+#--------------------------------------------------------------------------------------------------------------
+def invalidar_salud(nodo=None):
+  with salud_lock:
+    if nodo is None:
+      salud.clear()
+    else:
+      salud.pop(nodo, None)
+#
+#--------------------------------------------------------------------------------------------------------------
+# sondear_nodos: hace la prueba de conexion de todos los nodos recibidos a la vez, con a lo sumo max_sondeos
+# pruebas simultaneas. Devuelve una lista de booleanos (True = online) en el mismo orden que la lista recibida,
+# asi que el descubrimiento tarda mas o menos lo mismo que una sola prueba, haya o no nodos caidos.
+#--------------------------------------------------------------------------------------------------------------
+def sondear_nodos(lista, timeout=None, forzar=False):
+  if not lista:
+    return []
+
+  with ThreadPoolExecutor(max_workers=min(max_sondeos, len(lista))) as pool:
+    return list(pool.map(lambda nodo: en_linea(nodo, forzar, timeout), lista))
 #
 #--------------------------------------------------------------------------------------------------------------
 # ejecutar_shell: utiliza subprocess para ejecutar un comando del sistema. Recibe flag quiet (indica que la
@@ -76,7 +358,10 @@ def ejecutar_shell(comando, quiet, imprime, importante):
   if not quiet:
     print(f"\033[{atrib}m@ {comando}\033[33m")
 
-  salida = subprocess.getoutput(comando)
+  inicio = time.time()
+  rc, salida = subprocess.getstatusoutput(comando)
+  if archivo_traza:
+    registrar("local", comando.split()[0] if comando.split() else "", inicio, comando=comando, rc=rc)
 
   if not quiet and imprime:
     print(f"{salida}\033[0m")
@@ -84,13 +369,527 @@ def ejecutar_shell(comando, quiet, imprime, importante):
   return salida
 #
 #--------------------------------------------------------------------------------------------------------------
-# check_lam: verifica que el proceso lam.d este activo en el nodo maestro. Para eso revisa la salida del
-# comando lamnodes ejecutado en el maestro. Si lam.d no esta activo, entonces la salida empieza con "-". La
-# funcion devuelve True si LAM esta activo o False si no lo esta.
+# Transporte: como llega kfront a los nodos. Cada transporte sabe con que comando abrir una sesion de shell en
+# un nodo (argv, en que directorio y con que entorno), como adaptar un comando antes de mandarlo (traducir),
+# que comando corre el nodo que tiene un archivo para copiarlo a otro (copia), con que comando correr una sola
+# orden fuera de la sesion (argv_comando) y como probar si un nodo esta vivo (sondear). Esta clase base es el transporte rsh/rcp original; la prueba intenta abrir una conexion TCP a los
+# puertos de sondeo: si el nodo contesta (acepta o rechaza la conexion) esta online, si no se puede resolver el
+# nombre esta offline y si todos los intentos vencen por timeout (firewall, puerto filtrado) se prueba con ping.
+# compartido indica que todos los nodos ven los mismos archivos (lo que se deja en uno ya esta en todos).
+#--------------------------------------------------------------------------------------------------------------
+class Transporte:
+  puertos = [514, 22]
+  compartido = False
+
+  def argv(self, nodo):
+    return ["rsh", nodo, "sh"]
+
+  def argv_comando(self, nodo, comando):
+    return self.argv(nodo)[:-1] + [comando]
+
+  def directorio(self, nodo):
+    return home_dir
+
+  def entorno(self, nodo):
+    return None
+
+  def traducir(self, nodo, comando):
+    return comando
+
+  def copia(self, ruta, destino):
+    return f"rcp {ruta} {destino}:{ruta}"
+
+  def sondear(self, nodo, timeout):
+    for puerto in self.puertos if puertos_sondeo is None else puertos_sondeo:
+      try:
+        with socket.create_connection((nodo, puerto), timeout):
+          return True
+      except ConnectionRefusedError:
+        return True
+      except socket.gaierror:
+        return False
+      except OSError:
+        pass
+
+    return not ping(nodo, timeout)
+#
+#--------------------------------------------------------------------------------------------------------------
+# TransporteSsh: sesiones con ssh (sin pedir clave: hace falta tener la clave publica en los nodos) y copias con
+# scp. Solo se prueba el puerto de ssh.
 #--------------------------------------------------------------------------------------------------------------
-def check_lam():
-  salida = ejecutar_shell(f"rsh {maestro} lamnodes", True, False, False)
-  return ('-' not in salida)
+class TransporteSsh(Transporte):
+  puertos = [22]
+
+  def argv(self, nodo):
+    return ["ssh", "-T", "-o", "BatchMode=yes", nodo, "sh"]
+
+  def copia(self, ruta, destino):
+    return f"scp -q -B {ruta} {destino}:{ruta}"
+#
+#--------------------------------------------------------------------------------------------------------------
+# TransporteLocal: la sesion es un shell local en el home del usuario y todos los "nodos" son la maquina local,
+# asi que copiar un archivo entre nodos es solo verificar que este y todos estan siempre online (aunque los
+# nombres del archivo de nodos no existan en esta red).
+#--------------------------------------------------------------------------------------------------------------
+class TransporteLocal(Transporte):
+  compartido = True
+
+  def argv(self, nodo):
+    return ["sh"]
+
+  def argv_comando(self, nodo, comando):
+    return ["sh", "-c", comando]
+
+  def copia(self, ruta, destino):
+    return f"test -f {ruta}"
+
+  def sondear(self, nodo, timeout):
+    return True
+#
+#--------------------------------------------------------------------------------------------------------------
+# TransporteFalso: cluster falso para probar kfront a escala sin hardware. Cada nodo es un directorio de
+# dir_falso (que se crea la primera vez) que hace de home del nodo: la sesion es un shell local que corre ahi,
+# con HOME apuntando a ese directorio, y en cada comando las rutas del home del front se cambian por las del
+# nodo. Un nodo esta caido si su directorio tiene un archivo "caido". Los comandos de LAM y mpicc tienen que
+# estar en el PATH (pueden ser los de la maquina local o unos simulados).
+#--------------------------------------------------------------------------------------------------------------
+class TransporteFalso(Transporte):
+  def argv(self, nodo):
+    return ["sh"]
+
+  def argv_comando(self, nodo, comando):
+    return ["sh", "-c", comando]
+
+  def directorio(self, nodo):
+    directorio = os.path.join(dir_falso, nodo)
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+  def entorno(self, nodo):
+    return dict(os.environ, HOME=self.directorio(nodo), KFRONT_FALSO=dir_falso, KFRONT_NODO=nodo)
+
+  def traducir(self, nodo, comando):
+    return re.sub(re.escape(home_dir) + r"(?![\w.-])", lambda m: self.directorio(nodo), comando)
+
+  # La ruta de destino se arma con $KFRONT_FALSO para que traducir no la confunda con una ruta del front
+  def copia(self, ruta, destino):
+    if ruta == home_dir or ruta.startswith(home_dir + "/"):
+      return f'cp {ruta} "$KFRONT_FALSO/{destino}{ruta[len(home_dir):]}"'
+    return f"test -f {ruta}"
+
+  def sondear(self, nodo, timeout):
+    return not os.path.exists(os.path.join(dir_falso, nodo, "caido"))
+#
+#--------------------------------------------------------------------------------------------------------------
+# Canal: sesion de shell persistente en un nodo. Cada comando se manda por la entrada estandar de la sesion
+# encerrado en un subshell (asi un "cd" o un "exit" no la rompen), con la salida de error unida a la estandar,
+# y seguido de una marca unica con el codigo de salida. Se lee la salida linea a linea hasta la marca. Si la
+# sesion se corta, el canal queda muerto y el comando devuelve 255, como haria rsh.
+#--------------------------------------------------------------------------------------------------------------
+class Canal:
+  secuencia = itertools.count()
+
+  def __init__(self, nodo):
+    self.nodo = nodo
+    self.lock = threading.Lock()
+    self.ocupado = False
+    self.ultimo_uso = time.monotonic()
+    self.proc = subprocess.Popen(transporte.argv(nodo), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, text=True, bufsize=1, cwd=transporte.directorio(nodo),
+                                 env=transporte.entorno(nodo))
+
+  def vivo(self):
+    return self.proc.poll() is None
+
+  def cerrar(self):
+    try:
+      self.proc.stdin.close()
+    except OSError:
+      pass
+    try:
+      self.proc.wait(timeout=2)
+    except subprocess.TimeoutExpired:
+      self.proc.kill()
+
+  # ejecutar: corre el comando en la sesion y devuelve (codigo de salida, salida). Si se recibe una entrada
+  # (texto), se le pasa al comando por su entrada estandar; si no, el comando lee de /dev/null. Si se recibe
+  # por_linea, cada linea de la salida se le pasa a medida que llega y no se acumula (la salida devuelta es "").
+  def ejecutar(self, comando, entrada=None, por_linea=None):
+    marca = f"__KFRONT_{os.getpid()}_{next(Canal.secuencia)}__"
+    comando = transporte.traducir(self.nodo, comando)
+
+    if entrada is None:
+      script = f"( {comando}\n) </dev/null 2>&1\n"
+    else:
+      script = f"( {comando}\n) 2>&1 <<'{marca}'\n{entrada}\n{marca}\n"
+    script += f"printf '\\n{marca} %d\\n' $?\n"
+
+    with self.lock:
+      lineas = []
+      try:
+        self.proc.stdin.write(script)
+        self.proc.stdin.flush()
+        while True:
+          linea = self.proc.stdout.readline(65536) if por_linea else self.proc.stdout.readline()
+          if not linea:
+            self.cerrar()
+            if por_linea and lineas:
+              por_linea(lineas.pop())
+            return 255, "".join(lineas).rstrip("\n")
+          if linea.startswith(marca):
+            rc = int(linea.split()[1])
+            break
+          # Al ir pasando las lineas, la ultima se retiene hasta ver si es el salto agregado antes de la marca
+          if por_linea and lineas:
+            por_linea(lineas.pop())
+          lineas.append(linea)
+      except (OSError, ValueError):
+        self.cerrar()
+        return 255, "".join(lineas).rstrip("\n")
+      finally:
+        self.ultimo_uso = time.monotonic()
+
+    if por_linea:
+      if lineas and lineas[0] != "\n":
+        por_linea(lineas[0][:-1])
+      return rc, ""
+
+    # Se saca el salto de linea agregado antes de la marca y, como subprocess.getoutput, el ultimo de la salida
+    salida = "".join(lineas)[:-1]
+    return rc, salida[:-1] if salida.endswith("\n") else salida
+
+transportes = {"rsh": Transporte, "ssh": TransporteSsh, "local": TransporteLocal, "falso": TransporteFalso}
+
+if nombre_transporte not in transportes:
+  msg_error(f"KFRONT_TRANSPORTE debe ser uno de {', '.join(transportes)}", True)
+
+transporte = transportes[nombre_transporte]()
+#
+#--------------------------------------------------------------------------------------------------------------
+# cerrar_canales: cierra los canales que no se usan hace mas de inactividad_canal segundos, o todos si se pide
+# (al salir del programa).
+#--------------------------------------------------------------------------------------------------------------
+def cerrar_canales(todos=True):
+  ahora = time.monotonic()
+  cerrar = []
+  with canales_lock:
+    for lista in canales.values():
+      viejos = [c for c in lista if todos or not c.vivo() or (not c.ocupado and ahora-c.ultimo_uso > inactividad_canal)]
+      for c in viejos:
+        lista.remove(c)
+      cerrar += viejos
+  for c in cerrar:
+    c.cerrar()
+
+atexit.register(cerrar_canales)
+#
+#--------------------------------------------------------------------------------------------------------------
+# obtener_canal: devuelve un canal libre hacia el nodo (abriendo uno nuevo si no hay) y lo marca como ocupado;
+# quien lo pide lo tiene que liberar (ocupado=False) al terminar. De paso, cierra los canales inactivos.
+#--------------------------------------------------------------------------------------------------------------
+def obtener_canal(nodo):
+  cerrar_canales(False)
+
+  with canales_lock:
+    lista = canales.setdefault(nodo, [])
+    canal = next((c for c in lista if not c.ocupado and c.vivo()), None)
+    if canal is None:
+      canal = Canal(nodo)
+      lista.append(canal)
+    canal.ocupado = True
+
+  return canal
+#
+#--------------------------------------------------------------------------------------------------------------
+# ejecutar_remoto: como ejecutar_shell, pero ejecuta el comando en un nodo a traves de su canal persistente.
+# Devuelve la salida, o (codigo de salida, salida) si se pide con estado=True.
+#--------------------------------------------------------------------------------------------------------------
+def ejecutar_remoto(nodo, comando, quiet, imprime, importante, estado=False, entrada=None):
+  atrib = 35 if not importante else 36
+  if not quiet:
+    print(f"\033[{atrib}m@ {nodo}: {comando}\033[33m")
+
+  inicio = time.time()
+  try:
+    canal = obtener_canal(nodo)
+  except OSError as e:
+    rc, salida = 255, str(e)
+  else:
+    try:
+      rc, salida = canal.ejecutar(comando, entrada)
+    finally:
+      canal.ocupado = False
+
+  if archivo_traza:
+    registrar("remoto", comando.split()[0] if comando.split() else "", inicio, nodo, comando, rc)
+
+  if not quiet and imprime:
+    print(f"{salida}\033[0m")
+
+  return (rc, salida) if estado else salida
+#
+#--------------------------------------------------------------------------------------------------------------
+# ejecutar_en_nodos: ejecuta una lista de tareas (nodo, comando) con ejecutar_remoto, todas a la vez, con un
+# bucle de asyncio que respeta los limites max_remotos y max_por_nodo. Asi una operacion sobre todo el cluster
+# tarda lo que tarda el nodo mas lento y no la suma de todos. Devuelve la lista de (codigo de salida, salida)
+# en el orden de las tareas. Si no es quiet, muestra el comando y despues la salida agrupada: los nodos que
+# terminaron con el mismo codigo y la misma salida se listan juntos.
+#--------------------------------------------------------------------------------------------------------------
+def ejecutar_en_nodos(tareas, quiet, importante, entrada=None):
+  tareas = list(tareas)
+  if not tareas:
+    return []
+
+  async def todas(pool):
+    loop = asyncio.get_running_loop()
+    total = asyncio.Semaphore(max_remotos)
+    por_nodo = {nodo: asyncio.Semaphore(max_por_nodo) for nodo, comando in tareas}
+
+    async def una(nodo, comando):
+      async with por_nodo[nodo], total:
+        return await loop.run_in_executor(pool, ejecutar_remoto, nodo, comando, True, False, False, True, entrada)
+
+    return await asyncio.gather(*(una(nodo, comando) for nodo, comando in tareas))
+
+  if not quiet:
+    atrib = 35 if not importante else 36
+    comandos = {comando for nodo, comando in tareas}
+    titulo = next(iter(comandos)) if len(comandos) == 1 else f"{len(comandos)} comandos"
+    print(f"\033[{atrib}m@ {len(tareas)} nodo(s): {titulo}\033[33m")
+
+  with ThreadPoolExecutor(max_workers=min(max_remotos, len(tareas))) as pool:
+    resultados = asyncio.run(todas(pool))
+
+  if not quiet:
+    grupos = {}
+    for (nodo, comando), (rc, salida) in zip(tareas, resultados):
+      grupos.setdefault((rc, salida), []).append(nodo)
+    for (rc, salida), lista in grupos.items():
+      print(f"\t\033[{32 if rc == 0 else 31}m[{rc}] {', '.join(lista)}\033[33m")
+      if salida != "":
+        print(salida)
+    sys.stdout.write("\033[0m")
+
+  return resultados
+#
+#--------------------------------------------------------------------------------------------------------------
+# ejecutar_en_vivo: como ejecutar_remoto, pero para comandos largos y con mucha salida (mpirun). Cada linea se
+# muestra apenas llega (si eco=True) y se escribe en el archivo log (si se indica), pero solo se guardan las
+# ultimas lineas_salida. Mientras corre se muestra el tiempo transcurrido: en una terminal, en una linea de
+# estado que se va actualizando; si no, cada intervalo_vivo segundos. Devuelve (codigo de salida, ultimas
+# lineas de la salida). Puede haber varios a la vez (planificador), asi que los tiempos son todos locales.
+#--------------------------------------------------------------------------------------------------------------
+def ejecutar_en_vivo(nodo, comando, importante, log=None, eco=True):
+  atrib = 35 if not importante else 36
+  if eco:
+    print(f"\033[{atrib}m@ {nodo}: {comando}\033[33m")
+
+  ultimas = collections.deque(maxlen=lineas_salida)
+  terminal = eco and sys.stdout.isatty()
+  pantalla = threading.Lock()
+  termino = threading.Event()
+  inicio = time.monotonic()
+  comienzo = time.time()        # para la traza
+
+  def reloj():
+    t = int(time.monotonic() - inicio)
+    return f"{t//3600:02d}:{t//60%60:02d}:{t%60:02d}"
+
+  def linea(texto):
+    texto = texto.rstrip("\n")
+    ultimas.append(texto)
+    if archivo:
+      archivo.write(texto + "\n")
+    if eco:
+      with pantalla:
+        if terminal:
+          sys.stdout.write(f"\r\033[K\033[33m{texto}\n\033[0m[{reloj()}] {nodo}: corriendo\033[33m")
+        else:
+          sys.stdout.write(f"{texto}\n")
+        sys.stdout.flush()
+
+  def estado():
+    while not termino.wait(1 if terminal else intervalo_vivo):
+      with pantalla:
+        if terminal:
+          sys.stdout.write(f"\r\033[K\033[0m[{reloj()}] {nodo}: corriendo\033[33m")
+        else:
+          sys.stdout.write(f"\033[0m[{reloj()}] {nodo}: corriendo\033[33m\n")
+        sys.stdout.flush()
+
+  archivo = None
+  if log:
+    os.makedirs(os.path.dirname(log) or ".", exist_ok=True)
+    archivo = open(log, "w")
+
+  if eco:
+    threading.Thread(target=estado, daemon=True).start()
+
+  try:
+    canal = obtener_canal(nodo)
+  except OSError as e:
+    rc = 255
+    linea(str(e))
+  else:
+    try:
+      rc, salida = canal.ejecutar(comando, por_linea=linea)
+    finally:
+      canal.ocupado = False
+  finally:
+    termino.set()
+    if archivo:
+      archivo.close()
+
+  if archivo_traza:
+    registrar("remoto", comando.split()[0], comienzo, nodo, comando, rc)
+
+  if eco:
+    with pantalla:
+      sys.stdout.write("\r\033[K\033[0m" if terminal else "\033[0m")
+      sys.stdout.flush()
+    msg_note(f"Termino con codigo {rc} en {reloj()}")
+
+  return rc, "\n".join(ultimas)
+#
+#--------------------------------------------------------------------------------------------------------------
+# copiar_remoto: reemplaza a rcp desde el front. Manda el archivo local por el canal del nodo (codificado en
+# base64) y lo escribe en el destino indicado. Devuelve True si la copia salio bien.
+#--------------------------------------------------------------------------------------------------------------
+def copiar_remoto(origen, nodo, destino, quiet, imprime, importante):
+  if not quiet:
+    atrib = 35 if not importante else 36
+    print(f"\033[{atrib}m@ {origen} -> {nodo}:{destino}\033[33m")
+
+  with open(origen, "rb") as f:
+    datos = base64.encodebytes(f.read()).decode()
+
+  rc, salida = ejecutar_remoto(nodo, f"base64 -d > {destino}", True, False, False, True, datos.rstrip("\n"))
+
+  if not quiet and imprime:
+    print(f"{salida}\033[0m")
+
+  return rc == 0
+#
+#--------------------------------------------------------------------------------------------------------------
+# subir_archivo: manda un archivo local a un nodo por una conexion aparte de su canal (ver argv_comando), con el
+# archivo conectado a la entrada estandar de un cat en el nodo. Asi se transmite a medida que se lee, sin
+# cargarlo entero en memoria ni codificarlo. Devuelve (codigo de salida, salida).
+#--------------------------------------------------------------------------------------------------------------
+def subir_archivo(origen, nodo, destino):
+  comando = f"cat > {destino}"
+  inicio = time.time()
+
+  try:
+    with open(origen, "rb") as f:
+      proc = subprocess.run(transporte.argv_comando(nodo, transporte.traducir(nodo, comando)), stdin=f,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                            cwd=transporte.directorio(nodo), env=transporte.entorno(nodo))
+    rc, salida = proc.returncode, proc.stdout.rstrip("\n")
+  except OSError as e:
+    rc, salida = 255, str(e)
+
+  if archivo_traza:
+    registrar("remoto", "cat", inicio, nodo, comando, rc)
+
+  return rc, salida
+#
+#--------------------------------------------------------------------------------------------------------------
+# marcar_lam: registra el estado de la sesion LAM despues de que kfront lo cambio (o lo acaba de consultar).
+# Si se conoce el universo (la salida de lamnodes interpretada) queda guardado junto con el estado; si LAM no
+# esta activo, el universo es vacio.
+#--------------------------------------------------------------------------------------------------------------
+def marcar_lam(activo, universo=None):
+  estado_lam["activo"] = activo
+  estado_lam["universo"] = universo if activo else []
+  estado_lam["instante"] = time.monotonic()
+#
+#--------------------------------------------------------------------------------------------------------------
+# exclusivo_lam: decorador para las funciones que leen o cambian la sesion LAM. Las corre con lam_lock tomado,
+# asi el monitor no saca un nodo con un id que reconciliar_lam acaba de reasignar ni pisa estado_lam en medio
+# de un lamboot. El lock es reentrante: iniciar_lamboot puede llamar a leer_lamnodes.
+#--------------------------------------------------------------------------------------------------------------
+def exclusivo_lam(funcion):
+  @functools.wraps(funcion)
+  def exclusiva(*args, **kwargs):
+    with lam_lock:
+      return funcion(*args, **kwargs)
+  return exclusiva
+#
+#--------------------------------------------------------------------------------------------------------------
+# NodoLam: un nodo del universo LAM vivo, como lo informa lamnodes: id (el nX de LAM), nombre, cantidad de cpus
+# y si es el nodo origen (donde se corrio lamboot).
+#--------------------------------------------------------------------------------------------------------------
+NodoLam = collections.namedtuple("NodoLam", ["nro", "host", "cpus", "origen"])
+#
+#--------------------------------------------------------------------------------------------------------------
+# parsear_lamnodes: interpreta la salida de lamnodes y devuelve la lista de NodoLam. Las lineas de un universo
+# vivo tienen la forma "n0  nombre:cpus:flags"; cualquier otra (como el aviso de que no hay un lamd corriendo)
+# se ignora, asi que si LAM no esta activo la lista queda vacia.
+#--------------------------------------------------------------------------------------------------------------
+def parsear_lamnodes(salida):
+  universo = []
+  for linea in salida.splitlines():
+    campos = linea.split()
+    if len(campos) == 2 and campos[0][:1] == "n" and campos[0][1:].isdigit():
+      nombre, cpus, flags = (campos[1].split(":") + ["", ""])[:3]
+      universo.append(NodoLam(int(campos[0][1:]), nombre, int(cpus) if cpus.isdigit() else 1, "origin" in flags))
+  return universo
+#
+#--------------------------------------------------------------------------------------------------------------
+# leer_lamnodes: devuelve los nodos del universo LAM vivo (lista de NodoLam, vacia si LAM no esta activo). Con
+# forzar=False usa el universo guardado mientras tenga menos de ttl_lam segundos; si no, consulta lamnodes en el
+# maestro (un solo comando) y de paso actualiza el estado de LAM. Todas las preguntas sobre el universo (si LAM
+# esta activo, cuantos procesadores tiene, que nodos estan vivos) salen de aca.
+#--------------------------------------------------------------------------------------------------------------
+@exclusivo_lam
+def leer_lamnodes(forzar=True):
+  if not forzar and estado_lam["universo"] is not None and time.monotonic()-estado_lam["instante"] < ttl_lam:
+    return estado_lam["universo"]
+
+  universo = parsear_lamnodes(ejecutar_remoto(maestro, "lamnodes", True, False, False))
+  marcar_lam(bool(universo), universo)
+  return universo
+#
+#--------------------------------------------------------------------------------------------------------------
+# check_lam: verifica que el proceso lam.d este activo en el nodo maestro. Mientras el estado conocido tenga
+# menos de ttl_lam segundos lo devuelve sin tocar la red; si vencio, si no se conoce o si forzar=True lo
+# averigua con leer_lamnodes: LAM esta activo si lamnodes informa al menos un nodo. La funcion devuelve True si
+# LAM esta activo o False si no lo esta.
+#--------------------------------------------------------------------------------------------------------------
+def check_lam(forzar=False):
+  if not forzar and estado_lam["activo"] is not None and time.monotonic()-estado_lam["instante"] < ttl_lam:
+    return estado_lam["activo"]
+
+  leer_lamnodes()
+  return estado_lam["activo"]
+#
+#--------------------------------------------------------------------------------------------------------------
+# procesadores_lam: cantidad de procesadores del universo LAM vivo (los cpus de cada nodo de lamnodes, que son
+# los TIMES con que se agrego), sin probar los nodos uno por uno.
+#--------------------------------------------------------------------------------------------------------------
+def procesadores_lam():
+  return sum(v.cpus for v in leer_lamnodes(forzar=False))
+#
+#--------------------------------------------------------------------------------------------------------------
+# cpus_lam: los procesadores del universo LAM en el orden en que mpirun los numera (c0, c1, ...): los de cada
+# nodo por orden de id, tantos como sus cpus. Cada uno se identifica por (host, k), que no cambia aunque
+# reconciliar_lam o el monitor renumeren los nodos.
+#--------------------------------------------------------------------------------------------------------------
+def cpus_lam(universo=None):
+  if universo is None:
+    universo = leer_lamnodes(forzar=False)
+  return [(v.host, k) for v in sorted(universo, key=lambda v: v.nro) for k in range(v.cpus)]
+#
+#--------------------------------------------------------------------------------------------------------------
+# rango_lam: arma la lista de procesadores que entiende mpirun a partir de sus numeros, juntando los
+# consecutivos: [0, 1, 2, 3, 8] -> c0-3,8.
+#--------------------------------------------------------------------------------------------------------------
+def rango_lam(numeros, prefijo="c"):
+  partes = []
+  for _, grupo in itertools.groupby(enumerate(sorted(numeros)), lambda p: p[1] - p[0]):
+    grupo = [n for _, n in grupo]
+    partes.append(str(grupo[0]) if len(grupo) == 1 else f"{grupo[0]}-{grupo[-1]}")
+  return prefijo + ",".join(partes)
 #
 #--------------------------------------------------------------------------------------------------------------
 # leer_nombre_nodo: lee de teclado la IP/nombre de un nodo (no valida nada)
@@ -107,55 +906,326 @@ def leer_nro_nodo():
   return nodo
 #
 #--------------------------------------------------------------------------------------------------------------
+# detectar_cores: pregunta a cada nodo de la lista (todos a la vez) cuantos cores tiene, con nproc o, si no
+# esta, contando los procesadores de /proc/cpuinfo. Devuelve {nodo: cores} con los nodos que contestaron.
+#--------------------------------------------------------------------------------------------------------------
+def detectar_cores(lista):
+  if not lista:
+    return {}
+
+  salidas = ejecutar_en_nodos([(n, "nproc 2>/dev/null || grep -c ^processor /proc/cpuinfo") for n in lista], True, False)
+
+  return {n: int(salida.split()[-1]) for n, (rc, salida) in zip(lista, salidas)
+          if rc == 0 and salida.split() and salida.split()[-1].isdigit() and int(salida.split()[-1]) > 0}
+#
+#--------------------------------------------------------------------------------------------------------------
+# Nodo: un nodo del cluster. nro es su posicion en la lista de nodos (el id "nX" que ve el usuario), host su
+# nombre/IP, sel si es parte del cluster (SEL), online si paso la prueba de conexion y times la cantidad de
+# procesos MPI que LAM crea en el (TIMES).
+#--------------------------------------------------------------------------------------------------------------
+class Nodo:
+  __slots__ = ("nro", "host", "sel", "online", "times")
+
+  def __init__(self, host, sel, online, times):
+    self.nro = -1
+    self.host = host
+    self.sel = sel
+    self.online = online
+    self.times = times
+
+  @property
+  def id(self):
+    return f"n{self.nro}"
+#
+#--------------------------------------------------------------------------------------------------------------
+# Registro: la lista de nodos del cluster, en orden, con un indice por nombre/IP. El id de cada nodo es su
+# posicion, asi que buscar un nodo por id o por nombre no recorre la lista; al quitar, intercambiar u ordenar
+# nodos solo se actualiza el nro de los que cambiaron de lugar. Los cambios se hacen con lock tomado (el
+# monitor actualiza los nodos desde otro hilo) y recorrer el registro recorre una copia de la lista.
+#--------------------------------------------------------------------------------------------------------------
+class Registro:
+  def __init__(self):
+    self.lista = []
+    self.hosts = {}
+    self.lock = threading.RLock()
+
+  def __iter__(self):
+    with self.lock:
+      return iter(list(self.lista))
+
+  def __len__(self):
+    return len(self.lista)
+
+  def __getitem__(self, nro):
+    return self.lista[nro]
+
+  # por_id: devuelve el nodo del id ingresado por el usuario ("n3" o "3"), o None si no hay un nodo con ese id.
+  # Si lo ingresado no es un id, lanza ValueError.
+  def por_id(self, texto):
+    texto = texto.strip()
+    nro = texto[1:] if texto[:1] == "n" else texto
+    if not nro.isdigit():
+      raise ValueError(texto)
+    return self.lista[int(nro)] if int(nro) < len(self.lista) else None
+
+  def por_host(self, host):
+    return self.hosts.get(host)
+
+  def agregar(self, nodo):
+    with self.lock:
+      nodo.nro = len(self.lista)
+      self.lista.append(nodo)
+      self.hosts[nodo.host] = nodo
+    return nodo
+
+  def quitar(self, nodo):
+    with self.lock:
+      del self.lista[nodo.nro]
+      del self.hosts[nodo.host]
+      for nro in range(nodo.nro, len(self.lista)):
+        self.lista[nro].nro = nro
+
+  def intercambiar(self, a, b):
+    with self.lock:
+      self.lista[a.nro], self.lista[b.nro] = b, a
+      a.nro, b.nro = b.nro, a.nro
+
+  def ordenar(self, clave):
+    with self.lock:
+      self.lista.sort(key=clave)
+      for nro, nodo in enumerate(self.lista):
+        nodo.nro = nro
+
+nodos = Registro()
+#
+#--------------------------------------------------------------------------------------------------------------
+# leer_nodo: interpreta el id de nodo ingresado por el usuario. Devuelve el nodo o, si la entrada no es valida o
+# no hay un nodo con ese id, muestra el error y devuelve None.
+#--------------------------------------------------------------------------------------------------------------
+def leer_nodo(texto):
+  try:
+    nodo = nodos.por_id(texto)
+  except ValueError:
+    msg_error("Entrada invalida", False)
+    return None
+
+  if nodo is None:
+    msg_error("Nodo invalido", False)
+
+  return nodo
+#
+#--------------------------------------------------------------------------------------------------------------
+# revisar_cluster: una pasada del monitor. Prueba todos los nodos a la vez y, si LAM esta activo y el maestro
+# responde, lee el universo LAM (un solo lamnodes). Los nodos del universo que dejaron de responder (salvo el
+# origen, sin el que no hay universo) se sacan con un unico comando de lamshrink. Las pruebas se hacen sin locks
+# y el lamnodes y el lamshrink con lam_lock tomado (asi los ids del lamshrink son los de ese momento), pero sin
+# el lock del registro, para no frenar al menu ni al planificador mientras esperan al maestro. Recien despues se
+# toma el lock del registro para aplicar los cambios de ONLINE a todos los nodos de una vez y deseleccionar los
+# que salieron de LAM. Solo avisa lo que cambio.
+#--------------------------------------------------------------------------------------------------------------
+def revisar_cluster():
+  lista = list(nodos)
+  online = dict(zip([n.host for n in lista], sondear_nodos([n.host for n in lista], forzar=True)))
+  caidos = [host for host, ok in online.items() if not ok]
+
+  with lam_lock:
+    universo = []
+    if maestro != "-" and estado_lam["activo"] and online.get(maestro):
+      universo = leer_lamnodes()
+
+    muertos = [v for v in universo if not v.origen and any(mismo_host(host, v.host) for host in caidos)]
+    if muertos:
+      ejecutar_remoto(maestro, "; ".join(f"lamshrink n{v.nro}" for v in muertos), True, False, False)
+      marcar_lam(True, [v for v in universo if v not in muertos])
+
+    with nodos.lock:
+      for nodo in nodos:
+        if nodo.host not in online:
+          continue
+        if nodo.online != online[nodo.host]:
+          msg_note(f"{nodo.host} {'volvio a responder' if online[nodo.host] else 'ya no responde'}")
+        nodo.online = online[nodo.host]
+        if any(mismo_host(nodo.host, v.host) for v in muertos):
+          nodo.sel = False
+
+    if muertos:
+      msg_note(f"Se saco de LAM a {', '.join(v.host for v in muertos)}")
+
+  guardar_estado()
+#
+#--------------------------------------------------------------------------------------------------------------
+# monitor: hilo de fondo que llama a revisar_cluster cada intervalo_monitor segundos (mas o menos
+# fluctuacion_monitor).
+#--------------------------------------------------------------------------------------------------------------
+def monitor():
+  while True:
+    time.sleep(intervalo_monitor * random.uniform(1 - fluctuacion_monitor, 1 + fluctuacion_monitor))
+    try:
+      revisar_cluster()
+    except Exception as e:
+      msg_error(f"Fallo el monitor del cluster ({e})", False)
+#
+#--------------------------------------------------------------------------------------------------------------
 # load_default: carga lista de nodos por defecto (los nodos "alfa")
 #--------------------------------------------------------------------------------------------------------------
 def load_default():
-  global nodos
   global maestro
-  for i in range(5):
-    test = not ping(f"alfa0{i}")
-    maestro = f"alfa0{i}" if maestro == "-" and test else maestro
-    nodos.append([f"n{i}", f"alfa0{i}", (True and test), test])
+  nombres = [f"alfa0{i}" for i in range(5)]
+  online = sondear_nodos(nombres)
+  cores = detectar_cores([n for n, test in zip(nombres, online) if test])
+  for nombre, test in zip(nombres, online):
+    maestro = nombre if maestro == "-" and test else maestro
+    nodos.agregar(Nodo(nombre, test, test, cores.get(nombre, 1)))
 #
 #--------------------------------------------------------------------------------------------------------------
 # cargar_nodos: carga la lista de nodos del archivo de configuracion indicado en el argumento. Ignora todas las
-# lineas de comentarios (arrancan con "#") y realiza las pruebas de conexion en cada nodo. El primer nodo que
-# pase la prueba del ping va a ser asignado como maestro y va a tener el campo SEL en True siempre. Los demas
-# nodos van a tener SEL=True. Cualquier demora en la respuesta es por el timeout del ping. De fallar esta
-# prueba, se marcara al nodo como offline.
+# lineas de comentarios (arrancan con "#") y realiza las pruebas de conexion de todos los nodos en paralelo. El
+# primer nodo (en el orden del archivo) que pase la prueba del ping va a ser asignado como maestro y va a tener
+# el campo SEL en True siempre. Los demas nodos van a tener SEL=True. Cualquier demora en la respuesta es por el
+# timeout del ping, pero se paga una sola vez. De fallar esta prueba, se marcara al nodo como offline. Un nodo
+# repetido se carga una sola vez, con tantos procesos (TIMES) como veces aparece; si aparece una sola vez, se
+# usan los cores que informa el nodo.
 #--------------------------------------------------------------------------------------------------------------
 def cargar_nodos(archivo):
     global maestro
-    global nodos
 
     if not os.path.exists(archivo):
        msg_error("El archivo de configuracion no existe", True)
 
-    i = 0
-
+    veces = {}
     with open(archivo, "r") as f:
         for l in f:
             l = l.strip()
             if not l.startswith("#") and l:
-                offline = ping(l)
-                maestro = l if (maestro == "-" and not offline) else maestro
-                nodos.append([f"n{i}", l, (True and not offline), not offline])
-                i = i+1
-                
+                veces[l] = veces.get(l, 0) + 1
+    nombres = list(veces)
+
+    online = sondear_nodos(nombres)
+    cores = detectar_cores([n for n, test in zip(nombres, online) if test])
+
+    for nombre, test in zip(nombres, online):
+        maestro = nombre if (maestro == "-" and test) else maestro
+        times = veces[nombre] if veces[nombre] > 1 else cores.get(nombre, 1)
+        nodos.agregar(Nodo(nombre, test, test, times))
+
     if not nodos:
         msg_error("Listado invalido", True)
 
     return nodos
 #
 #--------------------------------------------------------------------------------------------------------------
+# origen_de_nodos: identifica la lista de nodos con la que arranca kfront (el archivo, por su ruta y un hash de
+# su contenido, o la lista por defecto) junto con el transporte, para saber si un estado guardado le sirve.
+# Devuelve None si el archivo no se puede leer.
+#--------------------------------------------------------------------------------------------------------------
+def origen_de_nodos(archivo):
+  if archivo is None:
+    return f"{nombre_transporte}:alfa"
+
+  try:
+    with open(archivo, "rb") as f:
+      return f"{nombre_transporte}:{os.path.realpath(archivo)}:{hashlib.sha1(f.read()).hexdigest()}"
+  except OSError:
+    return None
+#
+#--------------------------------------------------------------------------------------------------------------
+# guardar_estado: guarda el estado del cluster en archivo_estado, si cambio desde la ultima vez (o siempre, con
+# forzar=True, para renovar el instante). Se escribe en un archivo temporal y se renombra, asi nunca queda un
+# estado a medio escribir. No hace nada si la lista de nodos no la cargo main.
+#--------------------------------------------------------------------------------------------------------------
+def guardar_estado(forzar=False):
+  global ultimo_estado
+
+  if origen_estado is None or not nodos:
+    return
+
+  # Con el lock del registro: el monitor tambien guarda el estado
+  with nodos.lock:
+    estado = {"origen": origen_estado, "maestro": maestro, "lam": estado_lam["activo"],
+              "nodos": [[n.host, n.sel, n.online, n.times] for n in nodos]}
+    if estado == ultimo_estado and not forzar:
+      return
+
+    os.makedirs(dir_kfront, exist_ok=True)
+    with open(archivo_estado + ".tmp", "w") as f:
+      json.dump(dict(estado, instante=time.time()), f, indent=1)
+    os.replace(archivo_estado + ".tmp", archivo_estado)
+    ultimo_estado = estado
+
+atexit.register(guardar_estado, True)
+#
+#--------------------------------------------------------------------------------------------------------------
+# cargar_estado: arranque en caliente. Si el estado guardado es del mismo origen (ver origen_de_nodos) y no
+# vencio, arma la lista de nodos, el maestro y el estado conocido de LAM a partir de el, sin tocar la red, y
+# devuelve True. Si no, no carga nada y devuelve False.
+#--------------------------------------------------------------------------------------------------------------
+def cargar_estado(origen):
+  global maestro
+  global ultimo_estado
+
+  try:
+    with open(archivo_estado) as f:
+      estado = json.load(f)
+  except (OSError, ValueError):
+    return False
+
+  if estado.get("origen") != origen or time.time() - estado.get("instante", 0) > ttl_estado or not estado["nodos"]:
+    return False
+
+  for host, sel, online, times in estado["nodos"]:
+    nodos.agregar(Nodo(host, sel, online, times))
+  maestro = estado["maestro"]
+  if estado["lam"] is not None:
+    marcar_lam(estado["lam"])
+
+  ultimo_estado = {k: v for k, v in estado.items() if k != "instante"}
+  return True
+#
+#--------------------------------------------------------------------------------------------------------------
+# verificar_estado: confirma contra el cluster el estado que cargo cargar_estado. Prueba todos los nodos a la
+# vez y consulta LAM en el maestro (un solo comando). Un nodo que dejo de responder queda offline y sin
+# seleccionar, como al cargar la lista; si el que no responde es el maestro, el maestro pasa a ser el primer
+# nodo online. Solo avisa lo que cambio. main lo corre en segundo plano: las pruebas se hacen sin locks y el
+# resultado se aplica con lam_lock y el lock del registro tomados, como en revisar_cluster.
+#--------------------------------------------------------------------------------------------------------------
+def verificar_estado():
+  global maestro
+
+  lista = list(nodos)
+  online = sondear_nodos([n.host for n in lista], forzar=True)
+
+  with lam_lock, nodos.lock:
+    for nodo, test in zip(lista, online):
+      if nodo.online != test:
+        msg_note(f"{nodo.host} {'volvio a responder' if test else 'ya no responde'}")
+      nodo.online = test
+      nodo.sel = nodo.sel and test
+
+    if maestro != "-" and not en_linea(maestro):
+      previo = maestro
+      maestro = next((n.host for n in nodos if n.online), "-")
+      if maestro != "-":
+        nodos.por_host(maestro).sel = True
+      marcar_lam(False)
+      msg_note(f"El maestro {previo} no responde, nuevo maestro: {maestro}")
+
+    if maestro != "-":
+      activo = estado_lam["activo"]
+      if check_lam(forzar=True) != activo and activo is not None:
+        msg_note(f"LAM {'activo' if estado_lam['activo'] else 'inactivo'} en {maestro}")
+
+  guardar_estado()
+#
+#--------------------------------------------------------------------------------------------------------------
 # guardar_lamhosts: recorre la lista de nodos y arma un archivo temporal para iniciar el LAM usando solo los
-# nodos que esten online y con el campo SEL=True. Es un archivo de texto plano con los nombres de los nodos.
+# nodos que esten online y con el campo SEL=True. Es un archivo de texto plano con los nombres de los nodos y
+# la cantidad de procesos (TIMES) de cada uno, para que "mpirun C" use todos los cores.
 #--------------------------------------------------------------------------------------------------------------
 def guardar_lamhosts():
     with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
         for nodo in nodos:
-            if nodo[2]:
-                f.write(nodo[1] + ' slots=1\n')		# Guarda el nombre/IP del nodo seleccionado
+            if nodo.sel:
+                f.write(f"{nodo.host} slots={nodo.times} cpu={nodo.times}\n")		# Guarda el nombre/IP del nodo seleccionado
         return f.name
 #
 #--------------------------------------------------------------------------------------------------------------
@@ -166,40 +1236,46 @@ def guardar_lamhosts():
 #   nombre/IP       nombre o direccion IP del nodo
 #   seleccionado    muestra "O" si es parte del cluster o "X" si no lo es
 #   online          muestra "O" si el nodo es accesible/esta conectado a la red, o "X" si no lo es (falla ping)
+#   times           cantidad de procesos MPI que LAM va a crear en el nodo
+# y "lamd" si el nodo estaba en el universo LAM la ultima vez que se consulto (no se vuelve a consultar).
 #--------------------------------------------------------------------------------------------------------------
 def listar_nodos():
+  universo = estado_lam["universo"] or []
   print("\n\033[0mListado de nodos:\n"+"-"*40)
   for nodo in nodos:
-    attrib = "32" if nodo[2] else "37"
-    sys.stdout.write(f"\t\033[7;{attrib}m") if maestro == nodo[1] else sys.stdout.write(f"\t\033[0;{attrib}m")
-    print(f"{nodo[0]:<3}  {nodo[1]:<10}  [{bool2chr(nodo[2])}]  [{bool2chr(nodo[3])}]\033[0m")
+    attrib = "32" if nodo.sel else "37"
+    lamd = "  lamd" if any(mismo_host(nodo.host, v.host) for v in universo) else ""
+    sys.stdout.write(f"\t\033[7;{attrib}m") if maestro == nodo.host else sys.stdout.write(f"\t\033[0;{attrib}m")
+    print(f"{nodo.id:<3}  {nodo.host:<10}  [{bool2chr(nodo.sel)}]  [{bool2chr(nodo.online)}]  x{nodo.times}{lamd}\033[0m")
   print("-"*40)
 #
 #--------------------------------------------------------------------------------------------------------------
 # iniciar_lamboot: arma el archivo de configuracion lamhosts y lo envia al nodo maestro, para luego ejecutar el
 # comando "lamboot -v lamhosts". Valida que haya un nodo maestro seleccionado y que LAM no este activo.
 #--------------------------------------------------------------------------------------------------------------
+@fase
+@exclusivo_lam
 def iniciar_lamboot():
   if maestro == "-":
     msg_error("Nodo maestro indeterminado", False)
     return
     
-  if check_lam():
+  if check_lam(forzar=True):
     msg_note(f"LAM ya esta activo en {maestro}")
     return
 
   lamhosts_path = guardar_lamhosts()
 
   # Copiar el lamhosts al maestro e invocar lamboot -v lamhosts
-  ejecutar_shell(f"rcp {lamhosts_path} {maestro}:{home_dir}/lamhosts", False, False, False)
+  copiar_remoto(lamhosts_path, maestro, f"{home_dir}/lamhosts", False, False, False)
 
   # Hacer un eco para ver que se copio bien
   print("-"*40+"\nArchivo de configuracion recibido:\n")
-  print(ejecutar_shell(f"rsh {maestro} cat lamhosts", True, False, False))
+  print(ejecutar_remoto(maestro, "cat lamhosts", True, False, False))
   print("-"*40+"\n")
 
   # Verificar que se pueda llamar al cluster con recon
-  salida = ejecutar_shell(f"rsh {maestro} recon -v lamhosts", False, True, True)
+  salida = ejecutar_remoto(maestro, "recon -v lamhosts", False, True, True)
 
   # Luego llamar al lam con lamboot (silenciosamente porque traba la terminal remota)
   # Solo si el recon dio buen resultado
@@ -208,16 +1284,18 @@ def iniciar_lamboot():
     msg_error("Se ha producido un error al intentar iniciar LAM", False)
     return
 
-  ejecutar_shell(f"nohup rsh {maestro} lamboot -v lamhosts > /dev/null 2>&1 &", False, False, True)
+  ejecutar_remoto(maestro, "nohup lamboot -v lamhosts > /dev/null 2>&1 &", False, False, True)
 
-  # Esperar 5 segundos para darle tiempo al cluster para iniciar
-  time.sleep(5)
+  # Esperar a que el cluster termine de iniciar (o venza el plazo)
+  if not esperar_lam([n.host for n in nodos if n.sel]):
+    msg_error(f"LAM no termino de iniciar en {plazo_lam:.0f} segundos", False)
 
   # Probar la conectividad a los nodos con tping
-  ejecutar_shell(f"rsh {maestro} tping -c1 N", False, True, True)
+  ejecutar_remoto(maestro, "tping -c1 N", False, True, True)
 
-  # Listar los nodos en pantalla
-  ejecutar_shell(f"rsh {maestro} lamnodes", False, True, True)
+  # Listar los nodos en pantalla (de paso, queda registrado si LAM arranco)
+  universo = parsear_lamnodes(ejecutar_remoto(maestro, "lamnodes", False, True, True))
+  marcar_lam(bool(universo), universo)
 
   # Eliminar el archivo temporal
   os.remove(lamhosts_path)
@@ -225,21 +1303,56 @@ def iniciar_lamboot():
   return
 #
 #--------------------------------------------------------------------------------------------------------------
+# esperar_lam: espera a que todos los nodos esperados aparezcan en lamnodes, consultando con espera creciente
+# (ver espera_lam) hasta plazo_lam segundos. Informa cuando se une cada nodo, guarda el tiempo total en
+# metricas["lamboot"] y lo registra en la traza. Devuelve True si el universo quedo completo.
+#--------------------------------------------------------------------------------------------------------------
+@fase
+def esperar_lam(esperados):
+  inicio = time.monotonic()
+  comienzo = time.time()        # para la traza
+  espera = espera_lam
+  unidos = set()
+
+  while True:
+    for v in leer_lamnodes():
+      if v.host not in unidos:
+        unidos.add(v.host)
+        print(f"\t\033[32mn{v.nro:<3} {v.host:<10}  se unio a los {time.monotonic()-inicio:.1f} s\033[0m")
+
+    transcurrido = time.monotonic() - inicio
+    listo = all(any(mismo_host(e, u) for u in unidos) for e in esperados)
+    if listo or transcurrido >= plazo_lam:
+      metricas["lamboot"] = transcurrido
+      if archivo_traza:
+        registrar("local", "lamboot", comienzo, rc=0 if listo else 1)
+      if listo:
+        msg_note(f"LAM listo en {transcurrido:.1f} segundos")
+      return listo
+
+    time.sleep(min(espera, plazo_lam - transcurrido))
+    espera = min(espera * 2, espera_lam_max)
+#
+#--------------------------------------------------------------------------------------------------------------
 # chau_lam: detiene el entorno LAM, si esta activo
 #--------------------------------------------------------------------------------------------------------------
+@fase
+@exclusivo_lam
 def chau_lam():
   if maestro != "-":
-    if check_lam():
-      ejecutar_shell(f"rsh {maestro} lamhalt -v", False, True, True)
-      ejecutar_shell(f"rsh {maestro} wipe -v lamhosts", False, True, True)
+    if check_lam(forzar=True):
+      ejecutar_remoto(maestro, "lamhalt -v", False, True, True)
+      ejecutar_remoto(maestro, "wipe -v lamhosts", False, True, True)
+      marcar_lam(False)
     else:
       msg_note(f"LAM inactivo")
   else:
     msg_error("Nodo maestro indeterminado", False)
 #
 #--------------------------------------------------------------------------------------------------------------
-# imprimir_estado: imprime el estado del cluster. Nada sofisticado, solo hace la prueba del lamnodes e imprime
-# el nodo donde esta corriendo, si esta corriendo, o avisa que esta inactivo o que el nodo maestro no existe.
+# imprimir_estado: imprime el estado del cluster. Nada sofisticado, solo consulta el estado conocido de LAM e
+# imprime el nodo donde esta corriendo, si esta corriendo, o avisa que esta inactivo o que el nodo maestro no
+# existe.
 #--------------------------------------------------------------------------------------------------------------
 def imprimir_estado():
   if maestro == "-":
@@ -257,58 +1370,97 @@ def set_maestro():
   global maestro
 
   for n in nodos:
-    if n[3]:
-      maestro = n[1]
-      n[2] = True
+    if n.online:
+      maestro = n.host
+      n.sel = True
     break
 #
 #--------------------------------------------------------------------------------------------------------------
-# swap_nodos: realiza el intercambio de dos nodos recibidos como argumentos. Valida que existan y que LAM este
-# inactivo antes de realizar la operacion (sino lo mata).
+# mismo_host: compara un nombre de nodo de kfront con uno informado por LAM, que puede venir con dominio.
+#--------------------------------------------------------------------------------------------------------------
+def mismo_host(a, b):
+  if a == b:
+    return True
+  if a.replace(".", "").isdigit() or b.replace(".", "").isdigit():
+    return False
+  return a.split(".")[0] == b.split(".")[0]
+#
+#--------------------------------------------------------------------------------------------------------------
+# reiniciar_lam: apaga LAM desde el maestro anterior y lo vuelve a iniciar desde el actual.
+#--------------------------------------------------------------------------------------------------------------
+@exclusivo_lam
+def reiniciar_lam(maestro_previo):
+  ejecutar_remoto(maestro_previo, "lamhalt -v", False, False, False)
+  marcar_lam(False)
+  iniciar_lamboot()
+#
+#--------------------------------------------------------------------------------------------------------------
+# reconciliar_lam: se llama despues de cambiar la lista de nodos con LAM activo. Compara los nodos
+# seleccionados con los que LAM tiene vivos (lamnodes) y aplica, en un solo comando en el maestro, los lamshrink
+# de los que sobran y los lamgrow de los que faltan (con el menor id libre). Si se pide un intercambio (par de
+# nombres de swap_nodos), esos dos nodos se sacan y se vuelven a agregar con los ids cambiados, para que
+# mpirun respete el nuevo orden. LAM se reinicia por completo solo si cambio el maestro o si habria que tocar
+# al nodo origen del universo.
+#--------------------------------------------------------------------------------------------------------------
+@fase
+@exclusivo_lam
+def reconciliar_lam(maestro_previo, intercambio=()):
+  if maestro_previo != maestro:
+    reiniciar_lam(maestro_previo)
+    return
+
+  vivos = leer_lamnodes()
+  deseados = [n.host for n in nodos if n.sel]
+
+  def vivo(nombre):
+    return next((v for v in vivos if mismo_host(nombre, v.host)), None)
+
+  bajas = [v for v in vivos if not any(mismo_host(d, v.host) for d in deseados)]
+  altas = [(None, d) for d in deseados if vivo(d) is None]
+
+  if len(intercambio) == 2:
+    v1, v2 = vivo(intercambio[0]), vivo(intercambio[1])
+    if v1 and v2 and v1 not in bajas and v2 not in bajas:
+      bajas += [v1, v2]
+      altas += [(v2.nro, intercambio[0]), (v1.nro, intercambio[1])]
+
+  if any(v.origen for v in bajas):
+    reiniciar_lam(maestro_previo)
+    return
+
+  usados = {v.nro for v in vivos if v not in bajas} | {i for i, d in altas if i is not None}
+  libres = (i for i in itertools.count() if i not in usados)
+  altas = [(next(libres) if i is None else i, d) for i, d in altas]
+  comandos = [f"lamshrink n{v.nro}" for v in bajas] + [f"lamgrow -cpu {nodos.por_host(d).times} -n {i} {d}" for i, d in altas]
+
+  if comandos:
+    ejecutar_remoto(maestro, "; ".join(comandos), False, True, False)
+  marcar_lam(True)
+#
+#--------------------------------------------------------------------------------------------------------------
+# swap_nodos: realiza el intercambio de dos nodos recibidos como argumentos. Valida que existan y, si LAM esta
+# activo, le cambia los ids a los dos nodos (ver reconciliar_lam) en vez de reiniciarlo.
 #--------------------------------------------------------------------------------------------------------------
 def swap_nodos(n1, n2):
-  global nodos
   global maestro
   
   # Procesar la entrada, verificar que sea valida
   
-  try:
-    nro1 = int(''.join(filter(str.isdigit, n1)))
-    nro2 = int(''.join(filter(str.isdigit, n2)))
-  except:
-    msg_error("Entrada invalida", False)
-    return
-    
-  if nro1 > len(nodos)-1 or nro2 > len(nodos)-1:
-    msg_error("Nodo invalido", False)
+  nodo1 = leer_nodo(n1)
+  nodo2 = leer_nodo(n2) if nodo1 else None
+  if nodo2 is None:
     return
 
-  lo_mate = False                 # Hace falta apagar LAM?
   con_maestro = (maestro != "-")  # Esta definido el nodo maestro?
-    
-  if con_maestro:
-    #msg_error("Nodo maestro indefinido", False)
-    #return
-    
-    # Ver si LAM esta activo
-    if check_lam():
-      ejecutar_shell(f"rsh {maestro} lamhalt -v", False, False, False)
-      lo_mate = True
+  activo = con_maestro and check_lam()
 
   # Realizar intercambio
-  
-  aux = nodos[nro1]
-  auxn = nodos[nro1][0]
-  
-  nodos[nro1][0] = nodos[nro2][0]
-  nodos[nro2][0] = auxn
-  
-  nodos[nro1] = nodos[nro2]
-  nodos[nro2] = aux
-  
-  # Si LAM tuvo que ser detenido, lo tengo que reiniciar
-  if lo_mate:
-    iniciar_lamboot()
+
+  nodos.intercambiar(nodo1, nodo2)
+
+  # Si LAM esta activo, se acomoda al nuevo orden
+  if activo:
+    reconciliar_lam(maestro, (nodo1.host, nodo2.host))
 
   # Si el maestro no existe, tengo que definir uno nuevo
   if not con_maestro:
@@ -316,42 +1468,128 @@ def swap_nodos(n1, n2):
 #
 #---------------------------------------------------------------------------------------------------------------
 # reasignar_maestro: hace que un nodo especifico sea el maestro, a diferencia del reemplazo automatico. Si LAM
-# estuviese activo, se lo detiene porque si o si se va a tener que reordenar los nodos manualmente para que se
-# mantenga la correlacion entre el id del nodo en la lista y en el archivo lamhosts.
+# estuviese activo, se lo reinicia desde el nuevo maestro porque cambia el origen del universo LAM.
 #---------------------------------------------------------------------------------------------------------------
 def reasignar_maestro(n):
   global maestro
 
   # Procesar la entrada, verificar que sea valida
-  try:
-    nro = int(''.join(filter(str.isdigit, n)))
-  except:
-    msg_error("Entrada invalida", False)
+  nodo = leer_nodo(n)
+  if nodo is None:
     return
 
-  if nro > len(nodos)-1:
-    msg_error("Nodo invalido", False)
+  if not nodo.online:
+    msg_error("Nodo offline", False)
     return
 
-  if not nodos[nro][3]:
-    msg_error("Nodo offline", False)
+  previo = maestro
+  activo = maestro != "-" and check_lam()
+
+  maestro = nodo.host
+
+  nodos.intercambiar(nodos[0], nodo)
+  nodo.sel = True
+
+  if activo:
+    reconciliar_lam(previo)
+#
+#--------------------------------------------------------------------------------------------------------------
+# leer_puntajes / escribir_puntajes: cargan y guardan los resultados del benchmark, un diccionario nombre/IP ->
+# {"mflops", "mbs", "cores", "puntaje", "instante"}.
+#--------------------------------------------------------------------------------------------------------------
+def leer_puntajes():
+  try:
+    with open(os.path.join(dir_kfront, "benchmark.json")) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+def escribir_puntajes(puntajes):
+  os.makedirs(dir_kfront, exist_ok=True)
+  with open(os.path.join(dir_kfront, "benchmark.json"), "w") as f:
+    json.dump(puntajes, f, indent=1)
+#
+#--------------------------------------------------------------------------------------------------------------
+# medir_nodos: copia benchmark.c a cada nodo de la lista, lo compila y lo corre, todos los nodos a la vez.
+# Devuelve {nodo: resultado} con los nodos que se pudieron medir. El puntaje de un nodo es la media geometrica
+# de MFLOPS y MB/s (por core, porque el benchmark corre en un solo proceso).
+#--------------------------------------------------------------------------------------------------------------
+def medir_nodos(lista):
+  if not lista:
+    return {}
+
+  if not os.path.exists(fuente_benchmark):
+    msg_error(f"No se encuentra {fuente_benchmark}", False)
+    return {}
+
+  def medir(nodo):
+    binario = f"{home_dir}/.kfront_bench_{nodo}"
+    if not copiar_remoto(fuente_benchmark, nodo, f"{binario}.c", True, False, False):
+      return None
+    rc, salida = ejecutar_remoto(nodo, f"mpicc -o {binario} {binario}.c -O2 >/dev/null && "
+                                       f"echo $({binario}) $(nproc 2>/dev/null || grep -c ^processor /proc/cpuinfo); "
+                                       f"rm -f {binario} {binario}.c", True, False, False, True)
+    campos = salida.split("\n")[-1].split() if salida else []
+    try:
+      mflops, mbs, cores = float(campos[0]), float(campos[1]), int(campos[2])
+    except (IndexError, ValueError):
+      return None
+    return {"mflops": mflops, "mbs": mbs, "cores": max(cores, 1), "puntaje": (mflops * mbs) ** 0.5,
+            "instante": time.time()}
+
+  with ThreadPoolExecutor(max_workers=min(max_sondeos, len(lista))) as pool:
+    medidos = list(pool.map(medir, lista))
+
+  return {n: m for n, m in zip(lista, medidos) if m}
+#
+#--------------------------------------------------------------------------------------------------------------
+# ordenar_por_velocidad: ordena la lista de nodos segun el benchmark, del mas rapido al mas lento (los offline
+# y los que no tienen puntaje quedan al final, en el orden que tenian), renumera los ids y deja de maestro al
+# nodo mas rapido que este online. Solo cambia el orden: TIMES sigue siendo el que salio del archivo de nodos o
+# de los cores detectados (mas procesos que cores solo los haria competir entre si), pero como LAM reparte en
+# orden de ids, con -np los primeros procesos caen en los nodos mas rapidos. Solo se miden los nodos sin
+# puntaje o con un puntaje vencido, o todos si se pide forzar. Si LAM estaba activo y cambio algo, se reinicia.
+#--------------------------------------------------------------------------------------------------------------
+@fase
+def ordenar_por_velocidad(forzar=False):
+  global maestro
+
+  puntajes = leer_puntajes()
+  ahora = time.time()
+  en_red = [n.host for n in nodos if n.online]
+  pendientes = [n for n in en_red if forzar or ahora - puntajes.get(n, {}).get("instante", 0) > ttl_benchmark]
+
+  if pendientes:
+    msg_note(f"Midiendo la velocidad de {len(pendientes)} nodo(s)..")
+    medidos = medir_nodos(pendientes)
+    for nodo in pendientes:
+      if nodo not in medidos:
+        msg_error(f"No se pudo medir la velocidad de {nodo}", False)
+    puntajes.update(medidos)
+    escribir_puntajes(puntajes)
+
+  conocidos = {n: puntajes[n] for n in en_red if n in puntajes}
+  if not conocidos:
     return
 
-  lo_mate = False
+  previo = (maestro, [n.host for n in nodos])
+  activo = maestro != "-" and check_lam()
 
-  if check_lam():
-    ejecutar_shell(f"rsh {maestro} lamhalt -v", False, False, False)
-    lo_mate = True
+  nodos.ordenar(lambda n: (not n.online, -conocidos[n.host]["puntaje"] if n.host in conocidos else 0))
 
-  #swap_nodos("n0",n)
+  if nodos[0].online:
+    maestro = nodos[0].host
+    nodos[0].sel = True
 
-  maestro = nodos[nro][1]
-  nodos[0][2] = True
-  
-  swap_nodos("n0",n)
+  print("\n\033[0mVelocidad de los nodos (por core):\n"+"-"*40)
+  for n in nodos:
+    if n.host in conocidos:
+      p = conocidos[n.host]
+      print(f"\t{n.id:<3}  {n.host:<10}  {p['mflops']:>8.0f} MFLOPS  {p['mbs']:>8.0f} MB/s  x{n.times}")
+  print("-"*40)
 
-  if lo_mate:
-    iniciar_lamboot()
+  if activo and previo != (maestro, [n.host for n in nodos]):
+    reiniciar_lam(previo[0])
 #
 #--------------------------------------------------------------------------------------------------------------
 # menu de configuracion del cluster
@@ -368,7 +1606,9 @@ def estado_del_cluster():
     print("  2. Agregar nodo")
     print("  3. Remover nodo")
     print("  4. Cambiar estado de nodo")
-    print("  5. Reasignar maestro\n")
+    print("  5. Reasignar maestro")
+    print("  6. Actualizar estado de LAM")
+    print("  7. Medir velocidad y ordenar nodos\n")
     print("  0. Terminar y volver al menu\n")
 
     opcion = input("\033[4mElige una opcion:\033[0m ")
@@ -383,11 +1623,16 @@ def estado_del_cluster():
       seleccionar(leer_nro_nodo())
     elif opcion == "5":
       reasignar_maestro(leer_nro_nodo())
+    elif opcion == "6":
+      check_lam(forzar=True)
+    elif opcion == "7":
+      ordenar_por_velocidad(forzar=True)
     elif opcion == "0":
       break
     else:
       msg_error("Entrada incorrecta", False)
 
+    guardar_estado()
     listar_nodos()
     imprimir_estado()
 #
@@ -407,13 +1652,316 @@ def puedo_encolar():
   return puedo
 #
 #--------------------------------------------------------------------------------------------------------------
-# compilar_job: recibe la ruta a un archivo fuente *.c, lo copia al nodo maestro y compila con hcc.
+# leer_cache / escribir_cache: cargan y guardan el indice del cache de compilacion del front. El indice es un
+# diccionario clave -> {"fuente", "firma", "bytes", "uso", "nodos"}. Se llaman con cache_lock tomado.
+#--------------------------------------------------------------------------------------------------------------
+def leer_cache():
+  try:
+    with open(os.path.join(dir_kfront, "cache.json")) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+def escribir_cache(indice):
+  os.makedirs(dir_kfront, exist_ok=True)
+  with open(os.path.join(dir_kfront, "cache.json"), "w") as f:
+    json.dump(indice, f, indent=1)
+#
+#--------------------------------------------------------------------------------------------------------------
+# clave_compilacion: arma la clave de cache de un fuente compilado con opciones_mpicc para una arquitectura. Si
+# el fuente viene en un paquete, la huella del paquete tambien cuenta (cambiar un encabezado cambia la clave).
+# Si la firma no se conoce (ver agrupar_por_arquitectura) devuelve None: ese binario no se busca ni se guarda
+# en el cache.
+#--------------------------------------------------------------------------------------------------------------
+def clave_compilacion(archivo, firma, huella=""):
+  if firma.startswith(firma_desconocida):
+    return None
+
+  h = hashlib.sha256()
+  with open(archivo, "rb") as f:
+    h.update(f.read())
+  h.update(f"\0{opciones_mpicc}\0{firma}\0{huella}".encode())
+  return h.hexdigest()[:20]
+#
+#--------------------------------------------------------------------------------------------------------------
+# restaurar_de_cache: copia el binario de la clave desde el cache de cada nodo de la lista que lo tenga a la
+# ruta destino (en paralelo). Devuelve la lista de nodos donde se pudo restaurar; los nodos donde el binario ya
+# no estaba se borran del indice.
+#--------------------------------------------------------------------------------------------------------------
+@fase
+def restaurar_de_cache(clave, lista, destino):
+  with cache_lock:
+    entrada = leer_cache().get(clave)
+  candidatos = [n for n in lista if entrada and n in entrada["nodos"]]
+  if not candidatos:
+    return []
+
+  salidas = ejecutar_en_nodos([(n, f"cp {home_dir}/{dir_cache}/{clave} {destino}") for n in candidatos], True, False)
+  restaurados = [n for n, (rc, salida) in zip(candidatos, salidas) if rc == 0]
+
+  with cache_lock:
+    indice = leer_cache()
+    if clave in indice:
+      indice[clave]["nodos"] = [n for n in indice[clave]["nodos"] if n in restaurados or n not in candidatos]
+      indice[clave]["uso"] = time.time()
+      escribir_cache(indice)
+
+  return restaurados
+#
+#--------------------------------------------------------------------------------------------------------------
+# guardar_en_cache: guarda el binario que esta en la ruta origen de cada nodo de la lista en su cache, con la
+# clave recibida, lo anota en el indice y, si el cache se paso del limite, lo recorta.
+#--------------------------------------------------------------------------------------------------------------
+@fase
+def guardar_en_cache(clave, lista, origen, fuente, firma):
+  if not lista or clave is None:
+    return
+
+  comando = f"mkdir -p {home_dir}/{dir_cache} && cp {origen} {home_dir}/{dir_cache}/{clave} && wc -c < {origen}"
+  salidas = ejecutar_en_nodos([(n, comando) for n in lista], True, False)
+  guardados = [n for n, (rc, salida) in zip(lista, salidas) if rc == 0]
+  if not guardados:
+    return
+  tamanio = next(int(salida.split()[-1]) for rc, salida in salidas if rc == 0)
+
+  with cache_lock:
+    indice = leer_cache()
+    entrada = indice.setdefault(clave, {"fuente": fuente, "firma": firma, "bytes": tamanio, "nodos": []})
+    entrada["nodos"] = sorted(set(entrada["nodos"]) | set(guardados))
+    entrada["uso"] = time.time()
+    escribir_cache(indice)
+
+  recortar_cache(clave)
+#
+#--------------------------------------------------------------------------------------------------------------
+# uso_cache: lo que ocupa el cache en cada nodo (suma de los binarios de las entradas que lo tienen).
+#--------------------------------------------------------------------------------------------------------------
+def uso_cache(indice):
+  ocupado = collections.Counter()
+  for e in indice.values():
+    for n in e["nodos"]:
+      ocupado[n] += e["bytes"]
+  return ocupado
+#
+#--------------------------------------------------------------------------------------------------------------
+# recortar_cache: el limite es por nodo. En cada nodo donde el cache lo supere, borra de ese nodo (y solo de
+# ese) las entradas usadas hace mas tiempo hasta quedar dentro del limite, salvo la que se indique como
+# protegida. Todos los borrados van en una sola tanda; una entrada que ya no queda en ningun nodo sale del
+# indice.
+#--------------------------------------------------------------------------------------------------------------
+def recortar_cache(protegida=None):
+  with cache_lock:
+    indice = leer_cache()
+  ocupado = uso_cache(indice)
+
+  borrar = []                   # (clave, nodo)
+  for clave in sorted(indice, key=lambda c: indice[c]["uso"]):
+    if clave == protegida:
+      continue
+    for n in indice[clave]["nodos"]:
+      if ocupado[n] > limite_cache:
+        ocupado[n] -= indice[clave]["bytes"]
+        borrar.append((clave, n))
+
+  if not borrar:
+    return
+
+  ejecutar_en_nodos([(n, f"rm -f {home_dir}/{dir_cache}/{c}") for c, n in borrar], True, False)
+
+  with cache_lock:
+    indice = leer_cache()
+    for c, n in borrar:
+      if c in indice:
+        indice[c]["nodos"] = [x for x in indice[c]["nodos"] if x != n]
+        if not indice[c]["nodos"]:
+          indice.pop(c)
+    escribir_cache(indice)
+#
+#--------------------------------------------------------------------------------------------------------------
+# purgar_cache: borra una entrada del cache (o todas si no se indica ninguna), en los nodos y en el indice.
+#--------------------------------------------------------------------------------------------------------------
+def purgar_cache(clave=None):
+  with cache_lock:
+    indice = leer_cache()
+  claves = list(indice) if clave is None else [clave]
+
+  ejecutar_en_nodos([(n, f"rm -f {home_dir}/{dir_cache}/{c}") for c in claves for n in indice.get(c, {}).get("nodos", [])],
+                    True, False)
+
+  with cache_lock:
+    indice = leer_cache()
+    for c in claves:
+      indice.pop(c, None)
+    escribir_cache(indice)
+#
+#--------------------------------------------------------------------------------------------------------------
+# menu_cache: muestra el contenido del cache de compilacion y permite vaciarlo o borrar una entrada.
+#--------------------------------------------------------------------------------------------------------------
+def menu_cache():
+  while True:
+    with cache_lock:
+      indice = leer_cache()
+    claves = sorted(indice, key=lambda c: indice[c]["uso"], reverse=True)
+
+    print("\n\033[0mCache de compilacion:\n"+"-"*40)
+    for i, c in enumerate(claves):
+      e = indice[c]
+      uso = time.strftime("%d/%m %H:%M", time.localtime(e["uso"]))
+      print(f"\t{i:<3} {e['fuente']:<12} {e['bytes']//1024:>6} KB  {len(e['nodos']):>3} nodo(s)  {uso}  [{e['firma']}]")
+    ocupado = uso_cache(indice)
+    print("-"*40+f"\nTotal: {sum(ocupado.values())//1024} KB; el nodo mas cargado usa {max(ocupado.values(), default=0)//1024} KB"
+          f" de {limite_cache//1024} KB")
+
+    print("\n  1. Vaciar cache")
+    print("  2. Borrar entrada\n")
+    print("  0. Volver al menu\n")
+
+    opcion = input("\033[4mElige una opcion:\033[0m ")
+
+    if opcion == "1":
+      purgar_cache()
+    elif opcion == "2":
+      nro = input("Numero de entrada: ")
+      if nro.isdigit() and int(nro) < len(claves):
+        purgar_cache(claves[int(nro)])
+      else:
+        msg_error("Entrada invalida", False)
+    elif opcion == "0":
+      break
+    else:
+      msg_error("Entrada incorrecta", False)
+#
+#--------------------------------------------------------------------------------------------------------------
+# Paquete: un paquete de trabajo armado por armar_paquete. ruta es el tar.gz (un archivo temporal del front que
+# enviar_paquete borra al terminar), huella un hash del contenido de los archivos (no del tar, que cambia con las fechas) y make indica
+# si trae un Makefile.
+#--------------------------------------------------------------------------------------------------------------
+Paquete = collections.namedtuple("Paquete", ["ruta", "huella", "make"])
+#
+#--------------------------------------------------------------------------------------------------------------
+# directorio_trabajo: directorio de trabajo de un binario en los nodos (donde se desarma su paquete).
+#--------------------------------------------------------------------------------------------------------------
+def directorio_trabajo(binario):
+  return f"{home_dir}/{binario}.trabajo"
+#
+#--------------------------------------------------------------------------------------------------------------
+# armar_paquete: arma el paquete de un trabajo con el fuente y la lista de archivos adicionales. Cada archivo va
+# a la raiz del paquete con su nombre y cada directorio con su nombre y todo su contenido. El tar.gz se escribe
+# en un archivo temporal a medida que se arma. Si falta alguno, avisa y devuelve None.
+#--------------------------------------------------------------------------------------------------------------
+def armar_paquete(ruta_fuente, archivos):
+  rutas = [f"{ruta_fuente}.c"] + list(archivos)
+  for ruta in rutas:
+    if not os.path.exists(ruta):
+      msg_error(f"El archivo {ruta} no existe", False)
+      return None
+
+  descriptor, ruta_tar = tempfile.mkstemp(prefix="kfront-", suffix=".tar.gz")
+  os.close(descriptor)
+  huella = hashlib.sha256()
+  nombres = set()
+
+  with tarfile.open(ruta_tar, mode="w:gz") as tar:
+    for ruta in rutas:
+      ruta = ruta.rstrip("/")
+      if os.path.isdir(ruta):
+        contenido = sorted(os.path.join(d, a) for d, subdirs, lista in os.walk(ruta) for a in lista)
+      else:
+        contenido = [ruta]
+      for archivo in contenido:
+        nombre = os.path.relpath(archivo, os.path.dirname(ruta))
+        if nombre in nombres:
+          continue
+        nombres.add(nombre)
+        tar.add(archivo, arcname=nombre)
+        huella.update(f"{nombre}\0".encode())
+        with open(archivo, "rb") as f:
+          for bloque in iter(lambda: f.read(1 << 20), b""):
+            huella.update(bloque)
+        huella.update(b"\0")
+
+  msg_note(f"Paquete de {len(nombres)} archivo(s), {os.path.getsize(ruta_tar)//1024} KB comprimido")
+
+  return Paquete(ruta_tar, huella.hexdigest()[:20], bool(nombres & {"Makefile", "makefile", "GNUmakefile"}))
+#
+#--------------------------------------------------------------------------------------------------------------
+# enviar_paquete: manda el paquete a todos los nodos de la lista. El tar.gz se sube al maestro (o al primero de
+# la lista si el maestro no esta) con subir_archivo, de ahi se reparte al resto con difundir_archivo y despues
+# cada nodo, todos a la vez, lo desarma en el directorio de trabajo del binario (vaciandolo antes) y lo borra.
+# Si el transporte es compartido alcanza con mandarlo a un nodo. Devuelve True si llego a todos.
+#--------------------------------------------------------------------------------------------------------------
+@fase
+def enviar_paquete(paquete, binario, lista):
+  directorio = directorio_trabajo(binario)
+  archivo = f"{home_dir}/{binario}.tar.gz"
+  lista = lista[:1] if transporte.compartido else lista
+
+  try:
+    if not lista:
+      return True
+    origen = maestro if maestro in lista else lista[0]
+    rc, salida = subir_archivo(paquete.ruta, origen, archivo)
+  finally:
+    os.remove(paquete.ruta)
+
+  if rc != 0:
+    msg_error(f"No se pudo subir el paquete a {origen}: {salida}", False)
+    return False
+
+  resultado = difundir_archivo(archivo, origen, lista)
+  llegaron = [n for n in lista if n == origen or resultado[n][0]]
+  salidas = ejecutar_en_nodos([(n, f"rm -rf {directorio} && mkdir -p {directorio} && tar xzf {archivo} -C {directorio} && rm {archivo}")
+                               for n in llegaron], False, False)
+
+  if len(llegaron) < len(lista) or any(rc != 0 for rc, salida in salidas):
+    msg_error("No se pudo enviar el paquete a todos los nodos", False)
+    return False
+
+  return True
+#
+#--------------------------------------------------------------------------------------------------------------
+# comando_compilacion: comando para compilar el binario en un nodo. Sin paquete, compila el fuente que se copio
+# al home; con paquete, compila en el directorio de trabajo (ahi estan los encabezados y demas fuentes): con
+# make si el paquete trae un Makefile (el objetivo es el nombre del fuente, con CC=mpicc) o con mpicc si no.
+#--------------------------------------------------------------------------------------------------------------
+def comando_compilacion(paquete):
+  binario = f"{home_dir}/{nombre_binario}"
+
+  if paquete is None:
+    return f"mpicc -o {binario} {home_dir}/{nombre_fuente}.c {opciones_mpicc}"
+
+  directorio = directorio_trabajo(nombre_binario)
+  if paquete.make:
+    return f"cd {directorio} && make CC=mpicc {nombre_fuente} && cp {nombre_fuente} {binario}"
+  return f"cd {directorio} && mpicc -o {binario} {nombre_fuente}.c {opciones_mpicc}"
+#
+#--------------------------------------------------------------------------------------------------------------
+# pedir_archivos: si no se reciben, pide por teclado los archivos adicionales del trabajo (separados por
+# espacios; vacio = ninguno).
+#--------------------------------------------------------------------------------------------------------------
+def pedir_archivos(archivos):
+  if archivos is None:
+    archivos = input("Archivos o directorios adicionales (opcional): ").split()
+  return archivos
+#
+#--------------------------------------------------------------------------------------------------------------
+# compilar_job: recibe la ruta a un archivo fuente *.c, lo copia al nodo maestro y compila con hcc. Si el mismo
+# fuente ya se compilo para la arquitectura del maestro y el binario esta en su cache, lo usa directamente. Si
+# no se recibe la ruta se pide por teclado (junto con los archivos adicionales); con interactivo=False las
+# advertencias no se preguntan (se sigue). Si hay archivos adicionales, el fuente y los archivos van en un
+# paquete a todos los nodos seleccionados (los datos de entrada hacen falta en todos) y se compila en el
+# directorio de trabajo del maestro.
 #--------------------------------------------------------------------------------------------------------------
-def compilar_job():
+@fase
+def compilar_job(ruta_fuente=None, interactivo=True, archivos=None):
   global nombre_fuente
   global nombre_binario
+  global clave_binario
+  global dir_trabajo
   
-  ruta_fuente = input("Archivo fuente (sin extension): ")
+  if ruta_fuente is None:
+    ruta_fuente = input("Archivo fuente (sin extension): ")
+    archivos = pedir_archivos(archivos)
   
   if not os.path.exists(f"{ruta_fuente}.c"):
     msg_error(f"El archivo {ruta_fuente}.c no existe", False)
@@ -425,15 +1973,32 @@ def compilar_job():
   
   nombre_fuente = f"{os.path.basename(ruta_fuente)}"
   nombre_binario = nombre_fuente
+  cancelar_limpieza(nombre_binario)
   
   #
   #--------------------------------------------------------------------------------
 
-  ejecutar_shell(f"rcp {ruta_fuente}.c {maestro}:{nombre_fuente}.c", False, False, False)
+  paquete = armar_paquete(ruta_fuente, archivos) if archivos else None
+  if archivos and paquete is None:
+    return False
+  dir_trabajo = directorio_trabajo(nombre_binario) if paquete else None
+
+  if paquete and not enviar_paquete(paquete, nombre_binario, [n.host for n in nodos if n.sel]):
+    return False
+
+  firma = next(iter(agrupar_por_arquitectura([maestro])))
+  clave_binario = clave_compilacion(f"{ruta_fuente}.c", firma, paquete.huella if paquete else "")
+
+  if restaurar_de_cache(clave_binario, [maestro], f"{home_dir}/{nombre_binario}"):
+    msg_note(f"{nombre_fuente}.c sin cambios, se usa el binario del cache")
+    return True
+
+  if not paquete:
+    copiar_remoto(f"{ruta_fuente}.c", maestro, f"{nombre_fuente}.c", False, False, False)
   
   # Compilar el programa. Si falla, imprime la salida y elimina
 
-  salida = ejecutar_shell(f"rsh {maestro} mpicc -o {nombre_binario} {nombre_fuente}.c -lm", False, False, True)
+  salida = ejecutar_remoto(maestro, comando_compilacion(paquete), False, False, True)
   
   # Imprime la salida del compilador. Si contiene la palabra "error", se elimina todo archivo relacionado al codigo que fallo
   # De esta forma se consigue que, si es un warning, lo deje pasar
@@ -445,29 +2010,60 @@ def compilar_job():
   # Los errores de compilacion hacen que se pierda tiempo y causan errores de arrastre en el front, nunca se ignoran
   
   if hay_error != -1:
-    ejecutar_shell(f"rsh {maestro} rm {nombre_binario}*", False, False, True)
+    ejecutar_remoto(maestro, f"rm {nombre_binario}*", False, False, True)
     return False
     
   # Que analice los warnings, el usuario decide si ignorarlos o no... es su tiempo...
     
-  if hay_warn != -1:
+  if hay_warn != -1 and interactivo:
     que_hago = input("Hay advertencias, podria fallar la ejecucion. Continuar (S/N)? ")
     if que_hago.upper() != "S":
       msg_note("Ejecucion terminada por el usuario")
       return False
-    
+
+  guardar_en_cache(clave_binario, [maestro], f"{home_dir}/{nombre_binario}", nombre_fuente, firma)
+
   return True
 #
 #--------------------------------------------------------------------------------------------------------------
+# agrupar_por_arquitectura: consulta (en paralelo, y solo la primera vez) la firma de cada nodo -- tipo de
+# maquina y modelo de CPU -- y devuelve {firma: [nodos]} respetando el orden de la lista recibida. Si la
+# consulta falla en un nodo (un corte momentaneo, por ejemplo) su firma no se guarda, asi se vuelve a consultar
+# la proxima vez, y el nodo queda solo en un grupo de firma desconocida: se compila en el mismo nodo y sin cache.
+#--------------------------------------------------------------------------------------------------------------
+def agrupar_por_arquitectura(lista):
+  nuevos = [n for n in lista if n not in firmas]
+  comando = "uname -m && { grep -m1 'model name' /proc/cpuinfo | cut -d: -f2; true; }"
+  for nodo, (rc, salida) in zip(nuevos, ejecutar_en_nodos([(n, comando) for n in nuevos], True, False)):
+    if rc == 0 and salida.strip():
+      firmas[nodo] = " ".join(salida.split())
+    else:
+      msg_error(f"No se pudo consultar la arquitectura de {nodo}, se compila en el nodo", False)
+
+  grupos = {}
+  for nodo in lista:
+    grupos.setdefault(firmas.get(nodo, f"{firma_desconocida} {nodo}"), []).append(nodo)
+
+  return grupos
+#
+#--------------------------------------------------------------------------------------------------------------
 # compilar_en_todos: copia el fuente a cada nodo y compila localmente. Esto hace que no tenga que poner una
 # maquina vieja como maestro del cluster heterogeneo, asi puedo poner las mejores adelante del lamhosts y
-# ejecutar mpirun con mas nodos de los que tengo (las mas potentes van a tener mas de 1 proc mpi).
+# ejecutar mpirun con mas nodos de los que tengo (las mas potentes van a tener mas de 1 proc mpi). Los nodos
+# se agrupan por arquitectura: se compila una vez por grupo (todos los grupos en paralelo), se muestra la salida
+# del compilador de todos juntos para decidir una sola vez, y el binario se reparte al resto de cada grupo. La
+# ruta, los archivos adicionales (el paquete) y las advertencias se manejan igual que en compilar_job.
 #--------------------------------------------------------------------------------------------------------------
-def compilar_en_todos():
+@fase
+def compilar_en_todos(ruta_fuente=None, interactivo=True, archivos=None):
   global nombre_fuente
   global nombre_binario
+  global clave_binario
+  global dir_trabajo
   
-  ruta_fuente = input("Archivo fuente (sin extension): ")
+  if ruta_fuente is None:
+    ruta_fuente = input("Archivo fuente (sin extension): ")
+    archivos = pedir_archivos(archivos)
   
   if not os.path.exists(f"{ruta_fuente}.c"):
     msg_error(f"El archivo {ruta_fuente}.c no existe", False)
@@ -475,54 +2071,390 @@ def compilar_en_todos():
 
   nombre_fuente = f"{os.path.basename(ruta_fuente)}"
   nombre_binario = nombre_fuente
-  
+  cancelar_limpieza(nombre_binario)
+
+  seleccionados = [n.host for n in nodos if n.sel]
+
+  paquete = armar_paquete(ruta_fuente, archivos) if archivos else None
+  if archivos and paquete is None:
+    return False
+  dir_trabajo = directorio_trabajo(nombre_binario) if paquete else None
+
+  if paquete and not enviar_paquete(paquete, nombre_binario, seleccionados):
+    return False
+
+  grupos = agrupar_por_arquitectura(seleccionados)
+
+  binario = f"{home_dir}/{nombre_binario}"
+  claves = {firma: clave_compilacion(f"{ruta_fuente}.c", firma, paquete.huella if paquete else "") for firma in grupos}
+
+  # Se compila una vez por grupo, en el maestro si es parte del grupo y si no en el primer nodo del grupo,
+  # todos los grupos a la vez. Si el binario del grupo esta en el cache de alguno de sus nodos, se restaura
+  # alli y no se compila.
+
+  def compilar(par):
+    firma, grupo = par
+    restaurados = restaurar_de_cache(claves[firma], grupo, binario)
+    if restaurados:
+      nodo = maestro if maestro in restaurados else restaurados[0]
+      return nodo, 0, "", restaurados
+    nodo = maestro if maestro in grupo else grupo[0]
+    if not paquete and not copiar_remoto(f"{ruta_fuente}.c", nodo, f"{home_dir}/{nombre_fuente}.c", False, False, False):
+      return nodo, 255, f"No se pudo copiar {ruta_fuente}.c", []
+    rc, salida = ejecutar_remoto(nodo, comando_compilacion(paquete), False, False, True, True)
+    return nodo, rc, salida, []
+
+  with ThreadPoolExecutor(max_workers=len(grupos) or 1) as pool:
+    compilados = list(pool.map(compilar, grupos.items()))
+
+  # Resumen de la salida del compilador de todos los grupos, con una unica decision al final
+
   error = False
-  
-  for n in nodos:
-    if n[2]:
-      ejecutar_shell(f"rcp {ruta_fuente}.c {n[1]}:{home_dir}/{nombre_fuente}.c", False, False, False)
-      salida = ejecutar_shell(f"rsh {n[1]} mpicc -o {home_dir}/{nombre_binario} {home_dir}/{nombre_fuente}.c -lm", False, False, True)
-      if salida != "":
-        print(salida)
-        if (salida.upper()).find("ERROR") != -1:
-          msg_error(f"Hubo un problema al compilar en {n[1]}", False)
-          error = True
-          break
-        if (salida.upper()).find("WARNING") != -1:
-          que_hago = input("Hay advertencias, la ejecucion podria fallar. Continuar (S/N)? ")
-          if que_hago.upper() != "S":
-            msg_note("Ejecucion terminada por el usuario")
-            error = True
-            break
-        
+  hay_warn = False
+
+  print("-"*40+"\nResultado de la compilacion:\n")
+  for (firma, grupo), (nodo, rc, salida, restaurados) in zip(grupos.items(), compilados):
+    if restaurados:
+      print(f"\033[0m[{firma}] sin cambios, binario del cache en {len(restaurados)} de {len(grupo)} nodo(s)")
+      continue
+    print(f"\033[0m[{firma}] compilado en {nodo} para {len(grupo)} nodo(s)")
+    if salida != "":
+      print(salida)
+    if rc != 0 or (salida.upper()).find("ERROR") != -1:
+      msg_error(f"Hubo un problema al compilar en {nodo}", False)
+      error = True
+    elif (salida.upper()).find("WARNING") != -1:
+      hay_warn = True
+  print("-"*40)
+
+  if not error and hay_warn and interactivo:
+    que_hago = input("Hay advertencias, la ejecucion podria fallar. Continuar (S/N)? ")
+    if que_hago.upper() != "S":
+      msg_note("Ejecucion terminada por el usuario")
+      error = True
+
+  # Cada binario se reparte al resto de los nodos de su grupo (los que no lo sacaron del cache) y se guarda en
+  # el cache de todos los que lo recibieron
+
+  if not error:
+    def repartir(par):
+      (firma, grupo), (nodo, rc, salida, restaurados) = par
+      resultado = difundir_archivo(binario, nodo, [n for n in grupo if n not in restaurados])
+      nuevos = [n for n in grupo if n not in restaurados and resultado.get(n, (True,))[0]]
+      guardar_en_cache(claves[firma], nuevos, binario, nombre_fuente, firma)
+      return resultado
+
+    with ThreadPoolExecutor(max_workers=len(grupos) or 1) as pool:
+      resultado = {}
+      for parcial in pool.map(repartir, zip(grupos.items(), compilados)):
+        resultado.update(parcial)
+
+    if not informar_copia(resultado):
+      msg_error("No se pudo copiar el binario a todos los nodos", False)
+      error = True
+
+  # Si hay un solo tipo de nodo, el binario es el mismo en todos y tiene una unica clave
+
+  clave_binario = next(iter(claves.values())) if len(claves) == 1 and not error else None
+
   if error:
-    for n in nodos:
-      if n[2]:
-        ejecutar_shell(f"rsh {n[1]} rm {home_dir}/{nombre_binario}*", False, False, False)
+    ejecutar_en_nodos([(n, f"rm {home_dir}/{nombre_binario}*") for n in seleccionados], False, False)
     return False
-    
+
   return True
 #
 #--------------------------------------------------------------------------------------------------------------
-# copiar_binario: realiza la copia del archivo binario a todos los nodos del cluster
+# difundir_archivo: copia un archivo que esta en el nodo origen a la misma ruta en todos los destinos. Con
+# modo_copia="arbol" la copia se hace por rondas: en cada ronda cada nodo que ya tiene el archivo (empezando por
+# el origen) lo manda en paralelo a un nodo que no lo tiene, asi que N nodos se cubren en unas log2(N) copias y
+# la placa de red del origen deja de ser el cuello de botella. Un nodo al que la copia le fallo no reenvia.
+# Con modo_copia="secuencial" copia el origen a cada nodo, de a uno. Antes de copiar se comparan las sumas md5
+# (ver sumas_md5): a los destinos que ya tienen una copia identica no se les manda nada, y en el arbol reenvian
+# desde la primera ronda. Devuelve {destino: (ok, salida)}.
+#--------------------------------------------------------------------------------------------------------------
+@fase
+def difundir_archivo(ruta, origen, destinos):
+  resultado = {}
+  pendientes = [d for d in destinos if d != origen]
+  tienen = [origen]
+
+  sumas = sumas_md5(ruta, [origen] + pendientes) if pendientes else {}
+  if origen in sumas:
+    for destino in [d for d in pendientes if sumas.get(d) == sumas[origen]]:
+      resultado[destino] = (True, "sin cambios")
+      pendientes.remove(destino)
+      tienen.append(destino)
+
+  if modo_copia == "secuencial":
+    for destino in pendientes:
+      rc, salida = ejecutar_remoto(origen, transporte.copia(ruta, destino), False, False, False, True)
+      resultado[destino] = (rc == 0, salida)
+    return resultado
+
+  while pendientes:
+    pares = [(emisor, pendientes.pop(0)) for emisor in tienen[:len(pendientes)]]
+    salidas = ejecutar_en_nodos([(emisor, transporte.copia(ruta, destino)) for emisor, destino in pares], True, False)
+    for (emisor, destino), (rc, salida) in zip(pares, salidas):
+      resultado[destino] = (rc == 0, salida)
+      if rc == 0:
+        tienen.append(destino)
+
+  return resultado
+#
+#--------------------------------------------------------------------------------------------------------------
+# sumas_md5: calcula la suma md5 de un archivo en cada nodo de la lista, todos a la vez (un md5sum por nodo).
+# Devuelve {nodo: suma} con los nodos que tienen el archivo.
+#--------------------------------------------------------------------------------------------------------------
+def sumas_md5(ruta, lista):
+  salidas = ejecutar_en_nodos([(n, f"md5sum {ruta} 2>/dev/null") for n in lista], True, False)
+  return {n: salida.split()[0] for n, (rc, salida) in zip(lista, salidas) if rc == 0 and salida.split()}
+#
+#--------------------------------------------------------------------------------------------------------------
+# informar_copia: muestra el resultado de una difusion nodo por nodo y devuelve True si llego a todos.
+#--------------------------------------------------------------------------------------------------------------
+def informar_copia(resultado):
+  for destino, (ok, salida) in resultado.items():
+    if ok:
+      print(f"\t\033[32m{destino:<10}  [O]  {salida}\033[0m")
+    else:
+      print(f"\t\033[31m{destino:<10}  [X]  {salida}\033[0m")
+
+  return all(ok for ok, salida in resultado.values())
+#
+#--------------------------------------------------------------------------------------------------------------
+# copiar_binario: realiza la copia del archivo binario desde el maestro a todos los nodos seleccionados del
+# cluster (ver difundir_archivo) e informa a que nodos llego. Los nodos que ya tienen el binario en su cache de
+# compilacion lo toman de ahi.
 #--------------------------------------------------------------------------------------------------------------
+@fase
 def copiar_binario():
   if nombre_binario == "-":
     msg_error("No existe archivo binario", False)
     return False
-    
-  for nodo in nodos:
-    if nodo[1] != maestro and nodo[2]:
-      ejecutar_shell(f"rsh {maestro} rcp {nombre_binario} {nodo[1]}:{home_dir}/", False, False, False)
-      
+
+  binario = f"{home_dir}/{nombre_binario}"
+  destinos = [nodo.host for nodo in nodos if nodo.host != maestro and nodo.sel]
+
+  # Los nodos que tienen este binario en su cache lo restauran de ahi; al resto se le manda y se guarda
+
+  if clave_binario:
+    restaurados = restaurar_de_cache(clave_binario, destinos, binario)
+    destinos = [d for d in destinos if d not in restaurados]
+
+  resultado = difundir_archivo(binario, maestro, destinos)
+
+  if clave_binario:
+    with cache_lock:
+      entrada = leer_cache().get(clave_binario, {})
+    guardar_en_cache(clave_binario, [d for d, (ok, salida) in resultado.items() if ok], binario,
+                     entrada.get("fuente", nombre_fuente), entrada.get("firma", ""))
+
+  if not informar_copia(resultado):
+    msg_error("No se pudo copiar el binario a todos los nodos", False)
+    return False
+
   return True
 #
 #--------------------------------------------------------------------------------------------------------------
+# leer_np: interpreta el numero de procesos pedido. Devuelve None si es vacio (usar todos los procesadores) o el
+# numero; si no hay ningun numero, lanza ValueError.
+#--------------------------------------------------------------------------------------------------------------
+def leer_np(np_arg):
+  np_arg = str(np_arg)
+  if np_arg == "":
+    return None
+  return int(''.join(filter(str.isdigit, np_arg)))
+#
+#--------------------------------------------------------------------------------------------------------------
+# correr_mpirun: invoca mpirun en el maestro con el binario (que ya tiene que estar en los nodos) y los
+# argumentos recibidos, con np_val procesos o, si es None, uno por cada procesador de LAM (mpirun C, que usa el
+# TIMES de cada nodo). Si se indican cpus (por ejemplo c4-7, ver rango_lam) los procesos van a esos
+# procesadores y no a los primeros. La salida se va mostrando (si eco=True) y guardando en log (o, si no se
+# indica y esta definido KFRONT_LOGS, en un archivo de ese directorio) con ejecutar_en_vivo. Si el binario vino
+# en un paquete, los procesos corren en su directorio de trabajo (-wd). Devuelve (codigo, final de la salida).
+#--------------------------------------------------------------------------------------------------------------
+@fase
+def correr_mpirun(binario, args, np_val, log=None, eco=True, directorio=None, cpus=None):
+  if cpus:
+    procesos = cpus
+  else:
+    procesos = "C" if np_val is None else f"-np {np_val}"
+  if directorio:
+    procesos += f" -wd {directorio}"
+  if log is None and dir_logs:
+    log = os.path.join(dir_logs, f"{binario}-{time.strftime('%Y%m%d-%H%M%S')}.log")
+  return ejecutar_en_vivo(maestro, f"mpirun {procesos} {home_dir}/{binario} {args}", True, log, eco)
+#
+#--------------------------------------------------------------------------------------------------------------
+# leer_limpiezas / escribir_limpiezas: cargan y guardan las tareas de limpieza pendientes (ver limpiezas).
+# escribir_limpiezas se llama con limpieza_lock tomado y reemplaza el archivo de una vez.
+#--------------------------------------------------------------------------------------------------------------
+def leer_limpiezas():
+  try:
+    with open(archivo_limpieza) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return []
+
+def escribir_limpiezas():
+  os.makedirs(dir_kfront, exist_ok=True)
+  with open(archivo_limpieza + ".tmp", "w") as f:
+    json.dump(limpiezas, f, indent=1)
+  os.replace(archivo_limpieza + ".tmp", archivo_limpieza)
+#
+#--------------------------------------------------------------------------------------------------------------
+# binarios_cola: los fuentes de los trabajos de la cola que todavia no terminaron. Lee la cola una sola vez; el
+# recolector lo llama una vez por pasada, sin locks.
+#--------------------------------------------------------------------------------------------------------------
+def binarios_cola():
+  return {t["fuente"] for t in leer_cola() if t["estado"] in ("pendiente", "corriendo")}
+#
+#--------------------------------------------------------------------------------------------------------------
+# binario_protegido: devuelve True si borrar binario* de los nodos romperia el binario compilado actual o el de
+# alguno de los trabajos de en_cola (ver binarios_cola y binarios_en_conflicto).
+#--------------------------------------------------------------------------------------------------------------
+def binario_protegido(binario, en_cola):
+  if nombre_binario != "-" and binarios_en_conflicto(binario, nombre_binario):
+    return True
+
+  return any(binarios_en_conflicto(binario, f) for f in en_cola)
+#
+#--------------------------------------------------------------------------------------------------------------
+# recolectar: una pasada del recolector. Toma las tareas que ya toca intentar y cuyo binario no esta protegido,
+# manda un solo rm a cada nodo (todos los nodos a la vez, salvo los que no pasan la prueba de conexion) y saca
+# de la lista las que salieron bien. Las demas se reintentan despues, con espera creciente. Las pruebas de
+# conexion y la lectura de la cola se hacen sin locks; borrado_lock se toma recien para el rm, y antes se
+# vuelve a mirar que cada tarea siga pendiente y que su binario no sea el que se acaba de empezar a compilar.
+#--------------------------------------------------------------------------------------------------------------
+def recolectar():
+  ahora = time.time()
+  with limpieza_lock:
+    listas = [l for l in limpiezas if l["proximo"] <= ahora]
+
+  en_cola = binarios_cola()
+  protegidos = {b for b in {l["binario"] for l in listas} if binario_protegido(b, en_cola)}
+  listas = [l for l in listas if l["binario"] not in protegidos]
+  if not listas:
+    return
+
+  hosts = sorted({l["nodo"] for l in listas})
+  vivos = {n for n, test in zip(hosts, sondear_nodos(hosts)) if test}
+
+  with borrado_lock:
+    with limpieza_lock:
+      pendientes = {id(l) for l in limpiezas}
+      listas = [l for l in listas if id(l) in pendientes and not binario_protegido(l["binario"], ())]
+      borrando.update(l["binario"] for l in listas if l["nodo"] in vivos)
+
+    por_nodo = {}
+    for l in listas:
+      if l["nodo"] in vivos:
+        por_nodo.setdefault(l["nodo"], []).append(l)
+
+    try:
+      salidas = ejecutar_en_nodos([(n, "rm -rf " + " ".join(directorio_trabajo(l["binario"]) for l in por_nodo[n]) +
+                                    " && rm -f " + " ".join(f"{home_dir}/{l['binario']}*" for l in por_nodo[n]))
+                                   for n in por_nodo], True, False)
+    finally:
+      with limpieza_lock:
+        borrando.clear()
+
+  hechos = {n for n, (rc, salida) in zip(por_nodo, salidas) if rc == 0}
+
+  with limpieza_lock:
+    terminadas = {id(l) for l in listas if l["nodo"] in hechos}
+    for l in listas:
+      if id(l) not in terminadas:
+        l["intentos"] += 1
+        l["proximo"] = ahora + min(espera_limpieza * 2 ** l["intentos"], espera_limpieza_max)
+    limpiezas[:] = [l for l in limpiezas if id(l) not in terminadas]
+    escribir_limpiezas()
+#
+#--------------------------------------------------------------------------------------------------------------
+# recolector: hilo de fondo que hace una pasada de limpieza (recolectar) cada espera_limpieza segundos, o antes
+# si se programan tareas nuevas.
+#--------------------------------------------------------------------------------------------------------------
+def recolector():
+  while True:
+    limpieza_aviso.wait(espera_limpieza)
+    limpieza_aviso.clear()
+    try:
+      recolectar()
+    except Exception as e:
+      msg_error(f"Fallo la limpieza de los nodos ({e})", False)
+#
+#--------------------------------------------------------------------------------------------------------------
+# iniciar_recolector: la primera vez, carga las tareas que quedaron pendientes de otra sesion y arranca el hilo
+# del recolector si hay algo que limpiar (o si se pide con siempre=True).
+#--------------------------------------------------------------------------------------------------------------
+def iniciar_recolector(siempre=False):
+  global hilo_recolector
+
+  with limpieza_lock:
+    if hilo_recolector is not None:
+      return
+    limpiezas.extend(leer_limpiezas())
+    if not limpiezas and not siempre:
+      return
+    hilo_recolector = threading.Thread(target=recolector, name="recolector", daemon=True)
+    hilo_recolector.start()
+#
+#--------------------------------------------------------------------------------------------------------------
+# programar_limpieza: agrega una tarea por nodo para borrar binario* de los nodos de la lista y despierta al
+# recolector. No espera a que se borre.
+#--------------------------------------------------------------------------------------------------------------
+def programar_limpieza(binario, lista):
+  iniciar_recolector(True)
+
+  with limpieza_lock:
+    pendientes = {(l["nodo"], l["binario"]) for l in limpiezas}
+    limpiezas.extend({"nodo": n, "binario": binario, "intentos": 0, "proximo": 0}
+                     for n in lista if (n, binario) not in pendientes)
+    escribir_limpiezas()
+
+  limpieza_aviso.set()
+#
+#--------------------------------------------------------------------------------------------------------------
+# cancelar_limpieza: descarta las tareas pendientes de un binario que se vuelve a compilar. Solo si el
+# recolector esta borrando ese binario (o uno que lo pisa, ver binarios_en_conflicto) espera a que termine el
+# rm, asi no se lleva puesto el binario nuevo; si no, no toca borrado_lock. Se llama despues de cambiar
+# nombre_binario, asi el recolector ya lo ve protegido si todavia no empezo a borrar.
+#--------------------------------------------------------------------------------------------------------------
+def cancelar_limpieza(binario):
+  with limpieza_lock:
+    en_curso = any(binarios_en_conflicto(binario, b) for b in borrando)
+    if any(l["binario"] == binario for l in limpiezas):
+      limpiezas[:] = [l for l in limpiezas if l["binario"] != binario]
+      escribir_limpiezas()
+
+  if en_curso:
+    with borrado_lock:
+      pass
+#
+#--------------------------------------------------------------------------------------------------------------
+# limpiar_binario: programa el borrado del fuente, el binario, el posible volcado de memoria en caso de error
+# (core) y el directorio de trabajo en todos los nodos seleccionados (lo hace el recolector, en segundo plano) y, si se pide, invoca
+# lamclean (practica recomendada del manual). lamclean mata todos los procesos de usuario de LAM, asi que no se
+# debe usar si hay otro trabajo corriendo; por eso se hace en el momento y no queda para despues.
+#--------------------------------------------------------------------------------------------------------------
+@fase
+def limpiar_binario(binario, lamclean=True):
+  programar_limpieza(binario, [nodo.host for nodo in nodos if nodo.sel])
+
+  if lamclean:
+    ejecutar_remoto(maestro, "lamclean -v", False, False, True)
+#
+#--------------------------------------------------------------------------------------------------------------
 # ejecutar_job: copia el binario a cada uno de los nodos (seleccionados Y online, revisa ambos) e invoca el
-# comando mpirun C con las opciones recibidas. Luego, borra todos los archivos en los nodos (limpieza).
+# comando mpirun C con las opciones recibidas. Luego, borra todos los archivos en los nodos (limpieza). Los
+# argumentos y el numero de procesos se piden por teclado salvo que se reciban (modo batch), igual que el
+# archivo donde guardar la salida. Devuelve (codigo de salida, final de la salida) de mpirun, o None si no se
+# llego a ejecutar.
 #--------------------------------------------------------------------------------------------------------------
-def ejecutar_job(todos):
+@fase
+def ejecutar_job(todos, args=None, np_arg=None, log=None):
   global nombre_binario
+  global dir_trabajo
   
   if nombre_binario == "-":
     msg_error("Compile antes de ejecutar", False)
@@ -532,54 +2464,40 @@ def ejecutar_job(todos):
     if not copiar_binario():
       return
       
-  args = input("Argumentos del programa (opcional): ")
+  if args is None:
+    args = input("Argumentos del programa (opcional): ")
   
   #--------------------------------------------------------------------------------
   # Nota v2: que tome el numero de procesos MPI a generar y lo valide. Si es vacio,
   # que use todos los procesadores del cluster.
   
-  np_arg = input("Numero de procesos: ")
-  
-  # Que cuente los nodos que estan activados y accesibles desde la red
+  # Que cuente los procesadores que LAM tiene vivos (sin volver a probar cada nodo)
   
-  np_val = 0
-  
-  for n in nodos:
-    np_val = np_val+1 if (n[2] and not ping(n[1])) else np_val
+  np_val = procesadores_lam()
+
+  if np_arg is None:
+    np_arg = input(f"Numero de procesos (vacio = {np_val}): ")
   
-  if np_arg != "":
-    try:
-      np_val = int(''.join(filter(str.isdigit, np_arg)))
-    except:
-      msg_error("Entrada invalida", False)
-      return
-    else:
-      ejecutar_shell(f"rsh {maestro} mpirun -np {np_val} {home_dir}/{nombre_binario} {args}", False, True, True)
-  else:
-    ejecutar_shell(f"rsh {maestro} mpirun N {home_dir}/{nombre_binario} {args}", False, True, True)
-      
   # Un valor vacio del numero de procesos toma todos los que puede tomar
 
-  #ejecutar_shell(f"rsh {maestro} mpirun -np {np_val} {nombre_binario} {args}", False, True, True)
+  try:
+    np_pedido = leer_np(np_arg)
+  except ValueError:
+    msg_error("Entrada invalida", False)
+    return
+
+  rc, salida = correr_mpirun(nombre_binario, args, np_pedido, log, True, dir_trabajo)
   
   # Que haga un ruidito cuando termina la ejecucion
   
   ejecutar_shell('echo -en "007"', True, False, False)
   
-  # Elimino el fuente, el binario y el posible volcado de memoria en caso de error (core)
-    
-  for nodo in nodos:
-    if nodo[2]:
-      ejecutar_shell(f"rsh {nodo[1]} rm -f {home_dir}/{nombre_binario}*", False, False, False)
-      
-  #
-  #--------------------------------------------------------------------------------
-      
-  # Antes de salir, invoco lamclean (practica recomendada del manual)
-
-  ejecutar_shell(f"rsh {maestro} lamclean -v", False, False, True)
+  limpiar_binario(nombre_binario)
 
   nombre_binario = "-"
+  dir_trabajo = None
+
+  return rc, salida
 #
 #--------------------------------------------------------------------------------------------------------------
 # enviar_y_compilar_trabajo: compila, copia y manda a ejecutar un trabajo completo usando las funciones
@@ -608,48 +2526,38 @@ def enviar_y_compilar_trabajo():
 # lo agrega a la lista de nodos con SEL=True y lo agrega al LAM si esta activo.
 #--------------------------------------------------------------------------------------------------------------
 def agregar_nodo(nuevo):
-  if ping(nuevo):
+  if not en_linea(nuevo, forzar=True):
     msg_error(f"La direccion {nuevo} no es valida", False)
     return
 
-  i = 0
-  ya_esta = False
-
-  for nodo in nodos:
-    if nodo[1] == nuevo:
-      ya_esta = True
-      break
-    i = i+1
-
-  if ya_esta:
+  if nodos.por_host(nuevo):
     msg_error(f"{nuevo} ya es parte del cluster", False)
     return
 
-  nodos.append([f"n{i}", nuevo, True, not ping(nuevo)])
+  nodos.agregar(Nodo(nuevo, True, en_linea(nuevo), detectar_cores([nuevo]).get(nuevo, 1)))
   
   if maestro == "-":
     msg_error("Nodo maestro indeterminado", False)
     return
   
   if check_lam():
-    ejecutar_shell(f"rsh {maestro} lamgrow -n {i} {nuevo}", False, False, False)
+    reconciliar_lam(maestro)
   else:
     msg_note(f"LAM inactivo en {maestro}")
 #
 #--------------------------------------------------------------------------------------------------------------
-# quitar nodo: recibe un numero de nodo en formato cadena. Si es un numero valido y si esta LAM activo, invoca
-# lamshrink para remover el nodo del cluster. Si, ademas, no es el ultimo de la lista, lo marca como INVALIDO.
-# Si no esta activo, lo quita de la lista, este o no activo el cluster.
+# quitar nodo: recibe un numero de nodo en formato cadena. Si es un numero valido lo quita de la lista y, si LAM
+# esta activo, lo saca del universo con lamshrink (ver reconciliar_lam). Si era el maestro, se elige uno nuevo
+# y LAM se reinicia desde ahi.
 #--------------------------------------------------------------------------------------------------------------
 def quitar_nodo(borrar):
-  global nodos
   global maestro
   
   # Procesar la entrada, verificar que sea valida
   
   try:
-    nro = int(''.join(filter(str.isdigit, borrar)))
-  except:
+    nodo = nodos.por_id(borrar)
+  except ValueError:
     msg_error("Entrada invalida", False)
     return
     
@@ -665,49 +2573,33 @@ def quitar_nodo(borrar):
     msg_note("Hay un unico nodo")
     return
 
-  if nro > len(nodos)-1:
+  if nodo is None:
     msg_error("Nodo invalido", False)
     return
   
-  # Si justo es el maestro Y LAM esta activo, lo voy a tener que apagar
-  # Despues, borro el nodo sin culpa, reasigno las posiciones y reinicio LAM
-  if maestro == nodos[nro][1]:
-    lo_mate = False
-
-    if check_lam():
-      # Aca voy a tener que parar el LAM, borrar el nodo, reasignar maestro y reiniciar
-      ejecutar_shell(f"rsh {maestro} lamhalt -v", False, False, False)
-      lo_mate = True
+  previo = maestro
+  activo = check_lam()
+  era_maestro = (maestro == nodo.host)
 
-    nodos.remove(nodos[nro])
-    for i in range(nro,len(nodos)):
-      ant = int(''.join(filter(str.isdigit, nodos[i][0])))-1
-      nodos[i][0] = f"n{ant}"
+  # Borro el nodo sin culpa (el registro reasigna las posiciones)
 
-    set_maestro()
-    if lo_mate:
-      iniciar_lamboot()
-    return
+  invalidar_salud(nodo.host)
+  nodos.quitar(nodo)
 
-  else:
-    lo_mate = False
-    if check_lam():
-      ejecutar_shell(f"rsh {maestro} lamhalt -v", False, False, False)
-      lo_mate = True
+  # Si justo era el maestro, busco otro (y reconciliar_lam reinicia LAM desde el nuevo)
 
-    nodos.remove(nodos[nro])
-    for i in range(nro, len(nodos)):
-      ant = int(''.join(filter(str.isdigit, nodos[i][0])))-1
-      nodos[i][0] = f"n{ant}"
+  if era_maestro:
+    set_maestro()
 
-    if lo_mate:
-      iniciar_lamboot()
-      
-    return
+  if activo:
+    reconciliar_lam(previo)
 
-# Seleccionar nodos
-def seleccionar(nodo):
-  global nodos
+#
+#--------------------------------------------------------------------------------------------------------------
+# seleccionar: cambia el estado (SEL) de un nodo. Si LAM esta activo lo acomoda con reconciliar_lam, salvo que
+# se pida lo contrario (reconciliar=False, para acomodarlo una sola vez despues de varios cambios).
+#--------------------------------------------------------------------------------------------------------------
+def seleccionar(nodo, reconciliar=True):
   global maestro
   
   #--------------------------------------------------------------------------------
@@ -715,94 +2607,475 @@ def seleccionar(nodo):
   # Obviamente, el maestro no se puede deshabilitar.
 
   if nodo == "*":
+    previo = maestro
+    activo = maestro != "-" and check_lam()
+    sondear_nodos([n.host for n in nodos])    # todas las pruebas de conexion a la vez; despues salen del cache
     for n in nodos:
-        seleccionar(n[0])
+        seleccionar(n.id, False)
+    if activo:
+      reconciliar_lam(previo)
     return
     
   #
   #--------------------------------------------------------------------------------
   
-  try:
-    n = int(''.join(filter(str.isdigit, nodo)))
-  except:
-    msg_error("Entrada invalida", False)
+  n = leer_nodo(nodo)
+  if n is None:
     return
 
-  if n > len(nodos)-1:
-    msg_error("Nodo invalido", False)
-    return
-
-  lo_mate = False
-
-  if maestro == nodos[n][1]:
-    if check_lam():
-      ejecutar_shell(f"rsh {maestro} lamhalt -v", True, True, False)
-      lo_mate = True
+  previo = maestro
+  activo = reconciliar and maestro != "-" and check_lam()
 
-    nodos[n][2] = not nodos[n][2]
+  if maestro == n.host:
+    n.sel = not n.sel
 
     # El que deshabilite era el maestro... busco uno nuevo (si se puede)
     for n in nodos:
-      if n[1] != maestro and n[3] and n[2]:
-        maestro = n[1]
-        n[2] = True
+      if n.host != maestro and n.online and n.sel:
+        maestro = n.host
+        n.sel = True
         break
         
     # Me fijo si el maestro quedo seleccionado o no. Si no, lo habilito yo a mano
     # Esto es para que no quede un nodo maestro indeterminado y el usuario pueda causar problemas
-    for n in nodos:
-        if n[1] == maestro and not n[2]:
-            n[2] = True
+    n = nodos.por_host(maestro)
+    if not n.sel:
+        n.sel = True
 
-    # Si tuve que terminar LAM, lo reinicio
-    if lo_mate:
-      iniciar_lamboot()
+    # Si cambio el maestro, reconciliar_lam reinicia LAM desde el nuevo
+    if activo:
+      reconciliar_lam(previo)
 
     return
 
-  if nodos[n][1] == "INVALIDO":
+  if n.host == "INVALIDO":
     msg_error("Nodo invalido", False)
     return
 
-  #if not nodos[n][3]:
-  if ping(nodos[n][1]):
+  #if not n.online:
+  if not en_linea(n.host):
     msg_error("Nodo offline",False)
     return
   else:
-    nodos[n][3] = True
+    n.online = True
 
-  nodos[n][2] = not nodos[n][2]
+  n.sel = not n.sel
   
-  if maestro == "-" and nodos[n][2]:
-    maestro = nodos[n][1]
+  if maestro == "-" and n.sel:
+    maestro = n.host
     return
 
-  if check_lam():
-    if nodos[n][2]:
-      ejecutar_shell(f"rsh {maestro} lamgrow -n {n} {nodos[n][1]}", False, False, False)
+  if activo:
+    reconciliar_lam(previo)
+
+#
+#--------------------------------------------------------------------------------------------------------------
+# leer_manifiesto: lee el archivo de trabajos del modo batch (TOML, o JSON si termina en .json). Cada trabajo
+# es una tabla [[trabajo]] con los campos fuente (ruta sin extension, obligatorio), args, np (vacio = todos los
+# procesadores), todos (compilar en cada nodo), archivos (archivos o directorios adicionales que van en el
+# paquete del trabajo, ver armar_paquete) y log (archivo donde guardar la salida completa de mpirun, opcional).
+# Devuelve la lista de trabajos o termina si es invalido.
+#--------------------------------------------------------------------------------------------------------------
+def leer_manifiesto(archivo):
+  if not os.path.exists(archivo):
+    msg_error(f"El archivo {archivo} no existe", True)
+
+  with open(archivo, "rb") as f:
+    if archivo.endswith(".json"):
+      datos = json.load(f)
+    else:
+      try:
+        import tomllib
+      except ImportError:
+        msg_error("Para leer manifiestos TOML hace falta Python 3.11 o superior (se puede usar JSON)", True)
+      datos = tomllib.load(f)
+
+  trabajos = datos.get("trabajo", [])
+  if not trabajos:
+    msg_error(f"{archivo} no tiene trabajos", True)
+
+  for i, t in enumerate(trabajos):
+    if "fuente" not in t:
+      msg_error(f"El trabajo {i} de {archivo} no indica el fuente", True)
+    t.setdefault("nombre", os.path.basename(t["fuente"]))
+    t.setdefault("args", "")
+    t.setdefault("np", "")
+    t.setdefault("todos", False)
+    t["archivos"] = [t["archivos"]] if isinstance(t.get("archivos"), str) else t.get("archivos", [])
+
+  return trabajos
+#
+#--------------------------------------------------------------------------------------------------------------
+# modo_batch: corre todos los trabajos del manifiesto, uno detras de otro y sin preguntar nada, con un unico
+# arranque de LAM (si ya hay una sesion activa la reutiliza). Deja el resultado de cada trabajo (compilacion,
+# codigo de salida de mpirun, tiempo y final de la salida) en un archivo JSON y devuelve 0 si todos terminaron
+# bien o 1 si no.
+#--------------------------------------------------------------------------------------------------------------
+def modo_batch(archivo, resumen):
+  trabajos = leer_manifiesto(archivo)
+
+  if maestro == "-":
+    msg_error("Nodo maestro indeterminado", True)
+
+  if not check_lam(forzar=True):
+    iniciar_lamboot()
+    if not check_lam():
+      msg_error("No se pudo iniciar LAM", True)
+
+  resultados = []
+
+  for t in trabajos:
+    msg_note(f"Trabajo {t['nombre']} ({len(resultados)+1}/{len(trabajos)})")
+    inicio = time.time()
+    r = {"nombre": t["nombre"], "fuente": t["fuente"], "args": t["args"], "np": t["np"], "todos": t["todos"],
+         "inicio": inicio, "compilado": False, "rc": None, "salida": ""}
+
+    if t["todos"]:
+      r["compilado"] = compilar_en_todos(t["fuente"], False, t["archivos"])
+    else:
+      r["compilado"] = compilar_job(t["fuente"], False, t["archivos"])
+
+    if r["compilado"]:
+      ejecucion = ejecutar_job(t["todos"], t["args"], t["np"], t.get("log"))
+      if ejecucion:
+        r["rc"], r["salida"] = ejecucion
+
+    r["segundos"] = round(time.time() - inicio, 3)
+    resultados.append(r)
+
+  # Sin menu no hay apuro: se limpia ahora (lo que no se pueda queda para la proxima sesion)
+  recolectar()
+  chau_lam()
+
+  with open(resumen, "w") as f:
+    json.dump({"manifiesto": archivo, "maestro": maestro, "lamboot": metricas.get("lamboot"), "trabajos": resultados},
+              f, indent=1)
+
+  bien = sum(1 for r in resultados if r["rc"] == 0)
+  msg_note(f"{bien} de {len(resultados)} trabajos terminaron bien. Resultados en {resumen}")
+
+  return 0 if bien == len(resultados) else 1
+#
+#--------------------------------------------------------------------------------------------------------------
+# guardar_trabajo / leer_cola: guardan un trabajo de la cola (escritura atomica, para no dejar archivos a medio
+# escribir si se corta la luz) y leen los trabajos que todavia no terminaron (y, con historial=True, tambien los
+# terminados que se conservan), ordenados por prioridad (mayor primero) y por orden de llegada. Un trabajo
+# terminado o fallido se guarda en dir_hecho y sale de la cola (ver recortar_historial).
+#--------------------------------------------------------------------------------------------------------------
+def guardar_trabajo(t):
+  terminado = t["estado"] in ("terminado", "fallido")
+  directorio = dir_hecho if terminado else dir_cola
+  os.makedirs(directorio, exist_ok=True)
+  ruta = os.path.join(directorio, f"{t['id']}.json")
+  with open(ruta + ".tmp", "w") as f:
+    json.dump(t, f, indent=1)
+  os.replace(ruta + ".tmp", ruta)
+
+  if terminado:
+    try:
+      os.remove(os.path.join(dir_cola, f"{t['id']}.json"))
+    except FileNotFoundError:
+      pass
+    recortar_historial()
+
+def leer_cola(historial=False):
+  trabajos = []
+  for directorio in [dir_cola, dir_hecho] if historial else [dir_cola]:
+    if os.path.isdir(directorio):
+      for archivo in os.listdir(directorio):
+        if archivo.endswith(".json"):
+          try:
+            with open(os.path.join(directorio, archivo)) as f:
+              trabajos.append(json.load(f))
+          except (OSError, ValueError):
+            pass
+  return sorted(trabajos, key=lambda t: (-t["prioridad"], t["encolado"], t["id"]))
+#
+#--------------------------------------------------------------------------------------------------------------
+# recortar_historial: deja en dir_hecho solo los ultimos historial_cola trabajos terminados (por id, que sale de
+# la hora en que se encolaron) y borra los demas junto con su log de la cola, si lo tienen.
+#--------------------------------------------------------------------------------------------------------------
+def recortar_historial():
+  ids = sorted((a[:-5] for a in os.listdir(dir_hecho) if a.endswith(".json")),
+               key=lambda i: tuple(int(p) for p in i.split("-") if p.isdigit()))
+  for i in ids[:max(len(ids) - historial_cola, 0)]:
+    for ruta in (os.path.join(dir_hecho, f"{i}.json"), os.path.join(dir_cola, f"{i}.log")):
+      try:
+        os.remove(ruta)
+      except FileNotFoundError:
+        pass
+#
+#--------------------------------------------------------------------------------------------------------------
+# encolar: agrega a la cola los trabajos de un manifiesto (mismo formato que el modo batch). Cada trabajo puede
+# tener su propia prioridad; si no, se usa la recibida.
+#--------------------------------------------------------------------------------------------------------------
+def encolar(archivo, prioridad):
+  for i, t in enumerate(leer_manifiesto(archivo)):
+    t.update(id=f"{time.time_ns()}-{i}", prioridad=int(t.get("prioridad", prioridad)), estado="pendiente",
+             encolado=time.time(), inicio=None, fin=None, compilado=None, rc=None, salida="")
+    guardar_trabajo(t)
+    msg_note(f"Trabajo {t['nombre']} encolado con id {t['id']}")
+#
+#--------------------------------------------------------------------------------------------------------------
+# mostrar_cola: lista los trabajos de la cola, y los ultimos terminados, con su estado y cuanto esperaron (o
+# llevan esperando).
+#--------------------------------------------------------------------------------------------------------------
+def mostrar_cola():
+  trabajos = leer_cola(historial=True)
+  ahora = time.time()
+
+  print("\n\033[0mCola de trabajos:\n"+"-"*40)
+  for t in trabajos:
+    espera = (t["inicio"] or t["fin"] or ahora) - t["encolado"]
+    duracion = f"{t['fin']-t['inicio']:.0f} s" if t["fin"] and t["inicio"] else "-"
+    rc = "-" if t["rc"] is None else t["rc"]
+    print(f"\t{t['id']:<22} {t['nombre']:<12} p={t['prioridad']:<3} np={t['np'] or 'N':<4} {t['estado']:<10}"
+          f" espera {espera:>6.0f} s  duracion {duracion:>6}  rc={rc}")
+
+  pendientes = [t for t in trabajos if t["estado"] == "pendiente"]
+  print("-"*40+f"\nEn cola: {len(pendientes)}  Corriendo: {sum(1 for t in trabajos if t['estado'] == 'corriendo')}")
+  if pendientes:
+    print(f"Espera mas larga: {max(ahora-t['encolado'] for t in pendientes):.0f} s")
+#
+#--------------------------------------------------------------------------------------------------------------
+# binarios_en_conflicto: dos trabajos no pueden correr a la vez si sus binarios se pisan, porque la limpieza
+# (rm -f binario*) de uno borraria el del otro.
+#--------------------------------------------------------------------------------------------------------------
+def binarios_en_conflicto(a, b):
+  a, b = os.path.basename(a), os.path.basename(b)
+  return a.startswith(b) or b.startswith(a)
+#
+#--------------------------------------------------------------------------------------------------------------
+# correr_trabajo: paso final de un trabajo del planificador, en su propio hilo: mpirun, limpieza de los nodos
+# (sin lamclean, que lo hace el planificador cuando no queda nada corriendo) y registro del resultado. La salida
+# no se muestra (puede haber varios trabajos a la vez): queda en el log del trabajo, por defecto
+# ~/.kfront/cola/<id>.log. Los procesadores asignados (host, k) se traducen a ids de LAM recien aca, con el
+# universo de ese momento; si alguno ya no esta (el monitor saco su nodo mientras se compilaba), el trabajo
+# vuelve a la cola.
+#--------------------------------------------------------------------------------------------------------------
+def correr_trabajo(t, binario, np_val, directorio=None, asignados=None):
+  cpus = None
+  if asignados:
+    numeros = [i for i, cpu in enumerate(cpus_lam()) if cpu in asignados]
+    if len(numeros) < len(asignados):
+      limpiar_binario(binario, False)
+      t.update(estado="pendiente", inicio=None)
+      guardar_trabajo(t)
+      msg_note(f"Trabajo {t['nombre']} ({t['id']}) devuelto a la cola: perdio procesadores antes de empezar")
+      return
+    cpus = rango_lam(numeros)
+
+  rc, salida = correr_mpirun(binario, t["args"], np_val, t.get("log") or os.path.join(dir_cola, f"{t['id']}.log"), False, directorio, cpus)
+  limpiar_binario(binario, False)
+
+  t.update(estado="terminado" if rc == 0 else "fallido", rc=rc, fin=time.time(), salida=salida)
+  guardar_trabajo(t)
+  msg_note(f"Trabajo {t['nombre']} ({t['id']}) {t['estado']} con codigo {rc} en {t['fin']-t['inicio']:.1f} s")
+#
+#--------------------------------------------------------------------------------------------------------------
+# despachar: arranca un trabajo. La compilacion y la copia del binario usan las variables globales del
+# programa, asi que se hacen aca, de a un trabajo por vez; mpirun corre en un hilo aparte, en los procesadores
+# que le asigno el planificador. Devuelve el hilo, o None si el trabajo fallo antes de llegar a ejecutarse.
+#--------------------------------------------------------------------------------------------------------------
+def despachar(t, np_val, asignados=None):
+  global nombre_binario
+
+  t.update(estado="corriendo", inicio=time.time())
+  guardar_trabajo(t)
+  msg_note(f"Despachando {t['nombre']} ({t['id']}) tras {t['inicio']-t['encolado']:.0f} s en cola")
+
+  try:
+    if t["todos"]:
+      t["compilado"] = compilar_en_todos(t["fuente"], False, t.get("archivos", []))
     else:
-      ejecutar_shell(f"rsh {maestro} lamshrink {nodos[n][0]}", False, False, False)
-    ejecutar_shell(f"rsh {maestro} lamnodes", False, True, False)
+      t["compilado"] = compilar_job(t["fuente"], False, t.get("archivos", [])) and copiar_binario()
+    binario, directorio = nombre_binario, dir_trabajo
+  finally:
+    # Mientras corre, el binario lo protege su entrada en la cola (ver binarios_cola); si quedara como binario
+    # actual, el recolector no lo borraria nunca
+    nombre_binario = "-"
+
+  if not t["compilado"]:
+    t.update(estado="fallido", fin=time.time())
+    guardar_trabajo(t)
+    msg_error(f"El trabajo {t['nombre']} ({t['id']}) no se pudo compilar", False)
+    return None
+
+  hilo = threading.Thread(target=correr_trabajo, args=(t, binario, np_val, directorio, asignados), daemon=True)
+  hilo.start()
+  return hilo
+#
+#--------------------------------------------------------------------------------------------------------------
+# planificador: proceso que atiende la cola. Inicia LAM una sola vez (o usa la sesion activa) y, cada
+# intervalo_cola segundos, despacha los trabajos pendientes en orden mientras haya procesadores libres: un
+# trabajo necesita np procesadores, o todos si np es vacio. Cada trabajo recibe procesadores concretos de LAM
+# (ver cpus_lam) que quedan ocupados hasta que termina, asi dos trabajos no se apilan en los mismos. La
+# capacidad se toma del universo en cada vuelta, de modo que si el monitor saca un nodo caido deja de
+# contarse. Si el primero no entra, los siguientes que si entren lo pueden pasar (ver espera_max_backfill). Los
+# trabajos que quedaron "corriendo" de una ejecucion anterior del planificador vuelven a la cola. Se termina
+# con Ctrl-C: espera a los trabajos en curso, hace la limpieza pendiente de los nodos y detiene LAM.
+#--------------------------------------------------------------------------------------------------------------
+def planificador():
+  if maestro == "-":
+    msg_error("Nodo maestro indeterminado", True)
+
+  for t in leer_cola():
+    if t["estado"] == "corriendo":
+      t.update(estado="pendiente", inicio=None)
+      guardar_trabajo(t)
+    elif t["estado"] in ("terminado", "fallido"):
+      guardar_trabajo(t)        # quedo en la cola de una version que no los pasaba a dir_hecho
+
+  if not check_lam(forzar=True):
+    iniciar_lamboot()
+    if not check_lam():
+      msg_error("No se pudo iniciar LAM", True)
+
+  capacidad = procesadores_lam()
+  msg_note(f"Planificador activo con {capacidad} procesadores, cola en {dir_cola}")
+
+  corriendo = {}                # id -> (hilo, trabajo, procesadores asignados como (host, k))
+  sucio = False                 # hace falta lamclean cuando no quede nada corriendo
 
+  try:
+    while True:
+      for i in [i for i, (hilo, t, asignados) in corriendo.items() if not hilo.is_alive()]:
+        corriendo.pop(i)
+        sucio = True
+
+      if sucio and not corriendo:
+        ejecutar_remoto(maestro, "lamclean -v", False, False, True)
+        sucio = False
+
+      cpus = cpus_lam()
+      capacidad = len(cpus)
+      ocupados = set().union(*(asignados for hilo, t, asignados in corriendo.values()))
+      libres = [i for i, cpu in enumerate(cpus) if cpu not in ocupados]
+      bloqueado = False
+
+      # Sin universo (LAM caido) no se despacha ni se descarta nada hasta que vuelva
+      for t in [t for t in leer_cola() if t["estado"] == "pendiente" and capacidad]:
+        try:
+          np_val = leer_np(t["np"])
+        except ValueError:
+          np_val = -1
+        necesita = capacidad if np_val is None else np_val
+
+        if necesita < 1 or necesita > capacidad:
+          t.update(estado="fallido", fin=time.time(), salida=f"np invalido ({t['np']}) para {capacidad} procesadores")
+          guardar_trabajo(t)
+          continue
+
+        conflicto = any(binarios_en_conflicto(t["fuente"], c["fuente"]) for hilo, c, asignados in corriendo.values())
+
+        if necesita <= len(libres) and not conflicto and not bloqueado:
+          asignados = {cpus[i] for i in libres[:necesita]}
+          hilo = despachar(t, np_val, None if np_val is None else asignados)
+          if hilo:
+            corriendo[t["id"]] = (hilo, t, asignados)
+            libres = libres[necesita:]
+        elif not bloqueado:
+          # El primero que no entra reserva su lugar; si ya espero demasiado, nadie lo adelanta
+          bloqueado = time.time() - t["encolado"] > espera_max_backfill
+
+      time.sleep(intervalo_cola)
+
+  except KeyboardInterrupt:
+    msg_note(f"Terminando planificador, esperando {len(corriendo)} trabajo(s) en curso")
+    for hilo, t, asignados in corriendo.values():
+      hilo.join()
+    # Como en el modo batch, se limpia ahora (lo que no se pueda queda para la proxima sesion)
+    recolectar()
+    chau_lam()
+#
+#--------------------------------------------------------------------------------------------------------------
 # Programa principal
+#--------------------------------------------------------------------------------------------------------------
 def main():
-    archivo_nodos = sys.argv[1] if len(sys.argv) > 1 else "nodes"
+    global origen_estado
+
+    parser = argparse.ArgumentParser(description="KFRONT v.2 -- gestion de trabajos en un cluster LAM/MPI")
+    parser.add_argument("archivo_nodos", nargs="?", help="lista de nombres/IP de los nodos")
+    parser.add_argument("--batch", metavar="MANIFIESTO", help="corre los trabajos del manifiesto sin menu")
+    parser.add_argument("--resumen", metavar="ARCHIVO", help="resultados del modo batch (JSON)")
+    parser.add_argument("--encolar", metavar="MANIFIESTO", help="agrega los trabajos del manifiesto a la cola")
+    parser.add_argument("--prioridad", type=int, default=0, help="prioridad de los trabajos encolados")
+    parser.add_argument("--cola", action="store_true", help="muestra la cola de trabajos")
+    parser.add_argument("--planificador", action="store_true", help="atiende la cola de trabajos")
+    opciones = parser.parse_args()
+
+    # Encolar y mostrar la cola no necesitan el cluster
+
+    if opciones.encolar or opciones.cola:
+      if opciones.encolar:
+        encolar(opciones.encolar, opciones.prioridad)
+      if opciones.cola:
+        mostrar_cola()
+      return
 
     print("\nKFRONT v.2 --- Constantino Palacio 12/24\n")
 
-    if len(sys.argv) <= 1:
+    # Arranque en caliente: si hay un estado guardado para esta lista de nodos, se usa y se verifica de fondo
+
+    origen = origen_de_nodos(opciones.archivo_nodos)
+    caliente = arranque_en_caliente and origen is not None and cargar_estado(origen)
+
+    if caliente:
+        msg_note("Usando el estado guardado del cluster (se verifica en segundo plano)")
+        verificacion = threading.Thread(target=verificar_estado, name="verificacion", daemon=True)
+        verificacion.start()
+    elif opciones.archivo_nodos is None:
         msg_note("Usando configuracion por defecto")
         load_default()
     else:
       msg_note("Cargando lista de nodos..")
-      cargar_nodos(archivo_nodos)
-      
-    msg_note(f"Nodo maestro: {maestro}")
+      cargar_nodos(opciones.archivo_nodos)
+
+    origen_estado = origen
+
+    # Limpiezas que quedaron pendientes de una sesion anterior
+    iniciar_recolector()
+
+    # Monitor del cluster en segundo plano
+    if intervalo_monitor > 0:
+      threading.Thread(target=monitor, name="monitor", daemon=True).start()
+
+    # El estado guardado ya tiene el orden por velocidad. Sin menu se ordena ahora (si quedo una sesion de LAM,
+    # se reinicia con el orden nuevo y se usa); con menu, recien despues de cerrar la sesion que haya quedado,
+    # para no reiniciarla y apagarla enseguida
+    ordenar = ordenar_al_inicio and not caliente
+    sin_menu = opciones.batch or opciones.planificador
+
+    if sin_menu:
+      if ordenar:
+        ordenar_por_velocidad()
+      msg_note(f"Nodo maestro: {maestro}")
+
+    # Los trabajos sin menu esperan a que termine la verificacion
+    if caliente and sin_menu:
+      verificacion.join()
+
+    if opciones.batch:
+      resumen = opciones.resumen or os.path.splitext(opciones.batch)[0] + ".resultados.json"
+      sys.exit(modo_batch(opciones.batch, resumen))
+
+    if opciones.planificador:
+      planificador()
+      return
 
     if check_lam():
+      if caliente:
+        msg_note(f"Reutilizando la sesion de LAM abierta en {maestro}")
+      else:
         msg_note("Hay una sesion previa de LAM abierta, finalizando LAM..")
-        ejecutar_shell(f"rsh {maestro} lamhalt -v", True, False, False)
-        ejecutar_shell(f"rsh {maestro} wipe -v lamhosts", True, False, False)
+        with lam_lock:
+          ejecutar_remoto(maestro, "lamhalt -v", True, False, False)
+          ejecutar_remoto(maestro, "wipe -v lamhosts", True, False, False)
+          marcar_lam(False)
+
+    if ordenar:
+      ordenar_por_velocidad()
+    msg_note(f"Nodo maestro: {maestro}")
 
     while True:
         print("\n\033[0m" + "="*40 + "\n" + " "*4 + "W O R K L O A D   M A N A G E R" + "\n" + "="*40)
@@ -814,10 +3087,15 @@ def main():
         print("  6. Ejecutar")
         print("\n  7. Compilar y ejecutar programa")
         print("\n  8. Abrir editor de textos")
+        print("  9. Cache de compilacion")
         print("\n  0. Salir\n" + "="*40)
 
         opcion = input("\033[4mElige una opcion:\033[0m ")
 
+        # Ninguna opcion trabaja con un maestro o un LAM que la verificacion todavia puede cambiar
+        if caliente:
+          verificacion.join()
+
         if opcion == "1":
             estado_del_cluster()
         elif opcion == "2":
@@ -846,11 +3124,19 @@ def main():
             with tempfile.NamedTemporaryFile(suffix=".tmp") as tf:
               tf.flush()
               subprocess.call([EDITOR, tf.name])
+        elif opcion == "9":
+            menu_cache()
         elif opcion == "0":
+          # Con arranque en caliente, LAM puede quedar abierto para la proxima vez
+          if arranque_en_caliente and maestro != "-" and check_lam() and \
+             input("Dejar LAM activo para la proxima sesion? (s/N): ").strip().lower() == "s":
+            break
           chau_lam()
           break
         else:
             msg_error("Entrada incorrecta", False)
 
+        guardar_estado()
+
 if __name__ == "__main__":
     main()